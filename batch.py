@@ -0,0 +1,301 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import queue
+import time
+import traceback
+from functools import partial
+from multiprocessing import Pool
+
+from corpus import corpus_files, corpus_name, is_corpus
+from rulebank import split_rule_ref
+from statefile import STATES_FILE_EXT
+
+SUMMARY_SUFFIX = ".summary.json"
+
+
+def load_manifest(f_name):
+    """
+    Read the jobs of a manifest
+
+    A manifest is a JSON object with a "jobs" list, or just the list.  Each job has
+    the CLI arguments of one main.py run as "args", and optionally a "name" and an
+    "after" list naming jobs it must wait for.
+    """
+    with open(f_name, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    jobs = []
+    for i, job in enumerate(manifest["jobs"]):
+        if isinstance(job, list):
+            job = {"args": job}
+        job = dict(job)
+        job.setdefault("name", "job_{}".format(i))
+        job.setdefault("after", [])
+        jobs.append(job)
+
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names in {} must be unique".format(f_name))
+    return manifest, jobs
+
+
+def job_files(args):
+    """
+    Return the paths a job reads and the paths it writes, following the naming of
+    the files written by main.py
+    """
+    state_ext = STATES_FILE_EXT if args.binary else "json"
+    inputs = set()
+    outputs = set()
+
+    def generated(f_name):
+        outputs.add("{}.tendril_states.{}".format(f_name, state_ext))
+        outputs.add("{}.tendril.mid".format(f_name))
+        outputs.add("{}.tendril.png".format(f_name))
+
+    if args.convert:
+        inputs.add(args.convert)
+        outputs.add("{}.training_states.{}".format(args.convert, state_ext))
+    if args.learn and is_corpus(args.learn):
+        inputs.add(args.learn)
+        inputs.update(corpus_files(args.learn))
+        name = corpus_name(args.learn)
+        outputs.add("{}.rule.json".format(name))
+        outputs.add("{}.corpus_stats.json".format(name))
+        if args.generate:
+            generated(name)
+    elif args.learn:
+        inputs.add(args.learn)
+        outputs.add("{}.rule.json".format(args.learn))
+        if args.generate:
+            generated(args.learn)
+    if args.generateFrom:
+        inputs.add(split_rule_ref(args.generateFrom)[0])
+        generated(args.generateFrom.replace("#", ".r_"))
+    if args.tracks:
+        inputs.add(args.tracks)
+        outputs.add("{}.tendril.mid".format(args.tracks))
+    if args.seed:
+        inputs.add(args.seed)
+    if args.counts:
+        # counts files are read and written back
+        inputs.add(args.counts)
+        outputs.add(args.counts)
+
+    return (
+        set(map(os.path.abspath, inputs)),
+        set(map(os.path.abspath, outputs)),
+    )
+
+
+def parse_jobs(jobs):
+    """
+    Parse the CLI arguments of every job, returning the parsed arguments by job name
+    and the results of the jobs whose arguments don't parse, which fail without
+    running
+    """
+    from main import build_parser
+
+    parser = build_parser()
+    parsed = {}
+    failed = {}
+    for job in jobs:
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                parsed[job["name"]] = parser.parse_args(job["args"])
+        except (SystemExit, argparse.ArgumentError) as e:
+            status = 2
+            if isinstance(e, SystemExit):
+                # exit() with no code is a success, e.g. for --help
+                status = e.code if isinstance(e.code, int) else int(bool(e.code))
+            lines = (output.getvalue() or str(e)).strip().splitlines()
+            failed[job["name"]] = {
+                "name": job["name"],
+                "args": job["args"],
+                "status": status,
+                "error": lines[-1] if lines and status else None,
+                "seconds": 0.0,
+                "output": output.getvalue(),
+            }
+    return parsed, failed
+
+
+def resolve_dependencies(jobs, parsed=None):
+    """
+    Map each job name to the names of the jobs that must finish before it
+
+    A job depends on the jobs named in its "after" list and on the jobs writing files
+    it reads.  Jobs that read each other's files, like learners sharing a counts file,
+    run in manifest order.  Jobs missing from parsed, the arguments of each job by
+    name, read and write no files.
+    """
+    if parsed is None:
+        parsed = parse_jobs(jobs)[0]
+    files = [
+        job_files(parsed[job["name"]]) if job["name"] in parsed else (set(), set())
+        for job in jobs
+    ]
+    names = set(job["name"] for job in jobs)
+
+    dependencies = {}
+    for b, job in enumerate(jobs):
+        missing = set(job["after"]) - names
+        if missing:
+            raise ValueError(
+                "Job {} is after unknown jobs: {}".format(job["name"], sorted(missing))
+            )
+        after = set(job["after"])
+        inputs_b, outputs_b = files[b]
+        for a, other in enumerate(jobs):
+            if a == b:
+                continue
+            inputs_a, outputs_a = files[a]
+            if inputs_b & outputs_a and not (inputs_a & outputs_b and a > b):
+                after.add(other["name"])
+        dependencies[job["name"]] = after
+    return dependencies
+
+
+def init_worker():
+    # Import the CLI once per worker, rather than once per job
+    import main  # noqa: F401
+
+
+def run_job(job):
+    """
+    Run one job in the current process, returning its status, timing and output
+    """
+    from main import build_parser, execute
+
+    output = io.StringIO()
+    status = 0
+    error = None
+    start = time.time()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            execute(build_parser().parse_args(job["args"]))
+        except SystemExit as e:
+            # exit() with no code is a success
+            status = e.code if isinstance(e.code, int) else int(bool(e.code))
+        except Exception as e:
+            status = 1
+            error = "{}: {}".format(type(e).__name__, e)
+            output.write(traceback.format_exc())
+    return {
+        "name": job["name"],
+        "args": job["args"],
+        "status": status,
+        "error": error,
+        "seconds": time.time() - start,
+        "output": output.getvalue(),
+    }
+
+
+def job_failed(job, finished, e):
+    finished.put(
+        {
+            "name": job["name"],
+            "args": job["args"],
+            "status": 1,
+            "error": "{}: {}".format(type(e).__name__, e),
+            "seconds": 0.0,
+            "output": "",
+        }
+    )
+
+
+def run_manifest(f_name, workers=None, debug=False):
+    """
+    Run the jobs of a manifest on a process pool, each as soon as the jobs it depends
+    on have succeeded, and write a summary next to the manifest
+
+    Jobs depending on a failed job are skipped.  Returns the summary.
+    """
+    manifest, jobs = load_manifest(f_name)
+    # jobs whose arguments don't parse fail up front, without stopping the others
+    parsed, results = parse_jobs(jobs)
+    dependencies = resolve_dependencies(jobs, parsed)
+    workers = workers or manifest.get("workers") or os.cpu_count()
+
+    by_name = dict((job["name"], job) for job in jobs)
+    pending = [job["name"] for job in jobs if job["name"] not in results]
+    running = set()
+    finished = queue.Queue()
+
+    start = time.time()
+    with Pool(workers, initializer=init_worker) as pool:
+        while pending or running:
+            for name in list(pending):
+                after = dependencies[name]
+                if any(results.get(d, {}).get("status", 0) != 0 for d in after):
+                    pending.remove(name)
+                    results[name] = {
+                        "name": name,
+                        "args": by_name[name]["args"],
+                        "status": None,
+                        "error": "skipped after failed dependencies",
+                        "seconds": 0.0,
+                        "output": "",
+                    }
+                elif all(d in results for d in after):
+                    pending.remove(name)
+                    running.add(name)
+                    pool.apply_async(
+                        run_job,
+                        (by_name[name],),
+                        callback=finished.put,
+                        error_callback=partial(job_failed, by_name[name], finished),
+                    )
+
+            if not running:
+                if pending:
+                    # Only jobs waiting on each other are left
+                    raise ValueError("Circular job dependencies: {}".format(pending))
+                break
+
+            # Wait for any running job to finish
+            result = finished.get()
+            running.remove(result["name"])
+            results[result["name"]] = result
+            if debug:
+                print(result["output"], end="")
+
+    ordered = [results[job["name"]] for job in jobs]
+    summary = {
+        "manifest": f_name,
+        "workers": workers,
+        "wall_time": time.time() - start,
+        "succeeded": sum(1 for r in ordered if r["status"] == 0),
+        "failed": sum(1 for r in ordered if r["status"] not in (0, None)),
+        "skipped": sum(1 for r in ordered if r["status"] is None),
+        "jobs": ordered,
+    }
+
+    summary_file = f_name + SUMMARY_SUFFIX
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    for r in ordered:
+        if r["status"] == 0:
+            status = "ok"
+        elif r["status"] is None:
+            status = "skipped"
+        else:
+            status = "failed ({})".format(r["error"] or r["status"])
+        print("{}: {:.3f}s {}".format(r["name"], r["seconds"], status))
+    print(
+        "{} succeeded, {} failed, {} skipped in {:.3f}s".format(
+            summary["succeeded"],
+            summary["failed"],
+            summary["skipped"],
+            summary["wall_time"],
+        )
+    )
+    print("writing batch summary to: {}".format(summary_file))
+    return summary
@@ -0,0 +1,349 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+from collections import OrderedDict
+from itertools import product
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(ROOT, "examples")
+BASELINE_FILE = os.path.join(ROOT, "bench_kernels.baseline.json")
+RULE_FILE = os.path.join(EXAMPLES, "rules", "eca_8bit", "r_030.rule.json")
+MIDI_FILES = sorted(glob.glob(os.path.join(EXAMPLES, "midi", "*.midi")))
+
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.5  # fractional slowdown over the baseline that fails the run
+# Fast cases are called in loops of at least this many seconds, to time them reliably
+MIN_LOOP_TIME = 0.2
+
+WIDTHS = [32, 1024, 100000]
+STEPS = [96, 10000, 1000000]
+KERNEL_RADII = [1, 2, 3, 5, 8]
+
+# Sweeps skip sizes above these cell counts (width * steps), where a kernel would
+# run for minutes or run out of memory
+MAX_CELLS = {
+    "run": 40000000,
+    "eca": 1000000,
+    "learn": 40000000,
+    "metrics": 40000000,
+    "random_walk_sampler": 40000000,
+    "generate_pianoroll": 1000000,
+}
+
+
+def rule_for_radius(kernel_radius):
+    """
+    Rule 30 for radius 1, otherwise a rule learned from random states, so every radius
+    has a reproducible rule with a mix of live and dead neighborhoods
+    """
+    from ca import learn_rules_from_states
+    from midi import get_rule_from_file
+
+    if kernel_radius == 1:
+        return get_rule_from_file(RULE_FILE)
+    rng = np.random.default_rng(kernel_radius)
+    states = (rng.random((256, 256)) > 0.5).astype(np.uint8)
+    return learn_rules_from_states(states, kernel_radius)
+
+
+def seed_of_width(width):
+    seed = np.zeros(width, dtype=int)
+    seed[width // 2] = 1
+    return seed
+
+
+def states_of_size(width, steps):
+    from ca import run
+
+    return np.asarray(run(steps, seed_of_width(width), rule=rule_for_radius(1)))
+
+
+def sweep(kernel):
+    """
+    (width, steps) pairs of the sweep that fit the cell budget of a kernel
+    """
+    return [
+        (width, steps)
+        for width, steps in product(WIDTHS, STEPS)
+        if width * steps <= MAX_CELLS[kernel]
+    ]
+
+
+def kernel_cases():
+    """
+    Return an ordered mapping of case names to functions that set up a case and
+    return the callable to time
+    """
+    cases = OrderedDict()
+
+    def run_case(width, steps, kernel_radius):
+        def setup():
+            from ca import run
+
+            rule = rule_for_radius(kernel_radius)
+            seed = seed_of_width(width)
+            # compile outside of the timed call
+            run(1, seed, rule=rule)
+            return lambda: run(steps, seed, rule=rule)
+
+        return setup
+
+    for width, steps in sweep("run"):
+        cases["run/r1_w{}_s{}".format(width, steps)] = run_case(width, steps, 1)
+    for kernel_radius in KERNEL_RADII[1:]:
+        name = "run/r{}_w1024_s10000".format(kernel_radius)
+        cases[name] = run_case(1024, 10000, kernel_radius)
+
+    def eca_case(width, steps):
+        def setup():
+            from ca import eca, run
+
+            # rule 30 as the set of neighborhood codes mapping to 1
+            kernel = np.array([4, 2, 1])
+            r_set = [1, 2, 3, 4]
+            seed = seed_of_width(width)
+
+            def f(x, k):
+                return eca(x, k, r_set)
+
+            return lambda: run(steps, seed, kernel, f)
+
+        return setup
+
+    for width, steps in sweep("eca"):
+        cases["eca/w{}_s{}".format(width, steps)] = eca_case(width, steps)
+
+    def learn_case(width, steps, kernel_radius):
+        def setup():
+            from ca import learn_rules_from_states
+
+            states = states_of_size(width, steps)
+            return lambda: learn_rules_from_states(states, kernel_radius)
+
+        return setup
+
+    for width, steps in sweep("learn"):
+        cases["learn/r1_w{}_s{}".format(width, steps)] = learn_case(width, steps, 1)
+    for kernel_radius in KERNEL_RADII[1:]:
+        name = "learn/r{}_w1024_s10000".format(kernel_radius)
+        cases[name] = learn_case(1024, 10000, kernel_radius)
+
+    def states_case(f, width, steps):
+        def setup():
+            states = states_of_size(width, steps)
+            return lambda: f(states)
+
+        return setup
+
+    def metrics(states):
+        from stats import metrics
+
+        return metrics(states)
+
+    def random_walk_sampler(states):
+        from sampling import random_walk_sampler
+
+        return random_walk_sampler(states, rng=np.random.default_rng(0))
+
+    for kernel, f in [
+        ("metrics", metrics),
+        ("random_walk_sampler", random_walk_sampler),
+    ]:
+        for width, steps in sweep(kernel):
+            name = "{}/w{}_s{}".format(kernel, width, steps)
+            cases[name] = states_case(f, width, steps)
+
+    def pianoroll_case(width, steps):
+        def setup():
+            from midi import DEFAULT_BEAT_DURATION, generate_pianoroll
+            from scales import CHROMATIC_SCALE
+
+            states = states_of_size(width, steps)
+            scale = np.asarray(CHROMATIC_SCALE[0:width])
+            return lambda: generate_pianoroll(
+                states, steps, DEFAULT_BEAT_DURATION, scale
+            )
+
+        return setup
+
+    # the pianoroll has one column per MIDI note, so at most 128 cells per state
+    for width, steps in sweep("generate_pianoroll"):
+        if width <= 128:
+            name = "generate_pianoroll/w{}_s{}".format(width, steps)
+            cases[name] = pianoroll_case(width, steps)
+
+    def convert_case(f_name):
+        def setup():
+            from midi import convert_midi_to_state
+
+            # import pypianoroll outside of the timed call
+            import pypianoroll  # noqa: F401
+
+            return lambda: convert_midi_to_state(f_name)
+
+        return setup
+
+    for f_name in MIDI_FILES:
+        name = "convert_midi_to_state/{}".format(os.path.basename(f_name))
+        cases[name] = convert_case(f_name)
+
+    return cases
+
+
+def time_loop(f, number):
+    start = time.time()
+    for _ in range(number):
+        f()
+    return (time.time() - start) / number
+
+
+def time_case(setup, repeat=DEFAULT_REPEAT):
+    """
+    Return the fastest time per call of the callable returned by setup, over repeat
+    loops of enough calls to take MIN_LOOP_TIME
+    """
+    f = setup()
+    best = time_loop(f, 1)
+    number = max(1, int(MIN_LOOP_TIME / max(best, 1e-6)))
+    for _ in range(repeat):
+        best = min(best, time_loop(f, number))
+    return best
+
+
+def load_baseline(f_name=BASELINE_FILE):
+    if not os.path.exists(f_name):
+        return {"cases": {}}
+    with open(f_name, "r") as baseline_file:
+        return json.load(baseline_file)
+
+
+def write_baseline(results, f_name=BASELINE_FILE):
+    """
+    Store the timings of results in the baseline, keeping the cases that were not run
+    """
+    baseline = load_baseline(f_name)
+    baseline["machine"] = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+    cases = baseline.get("cases", {})
+    cases.update(results)
+    baseline["cases"] = OrderedDict(sorted(cases.items()))
+    with open(f_name, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+    print("writing baseline to: {}".format(f_name))
+
+
+def benchmark(patterns=None, repeat=DEFAULT_REPEAT):
+    """
+    Time every case whose name contains one of patterns, or all cases, yielding
+    (name, seconds) as each case finishes
+    """
+    for name, setup in kernel_cases().items():
+        if patterns and not any(p in name for p in patterns):
+            continue
+        yield name, time_case(setup, repeat)
+
+
+def compare(name, seconds, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Return the status of a result against its baseline, and its report line
+    """
+    base = baseline["cases"].get(name)
+    if base is None:
+        return "new", "{}: {:.4f}s (no baseline)".format(name, seconds)
+    status = "ok"
+    if seconds > base * (1 + tolerance):
+        status = "REGRESSION"
+    return (
+        status,
+        "{}: {:.4f}s (baseline {:.4f}s, {:+.0%}) {}".format(
+            name, seconds, base, seconds / base - 1, status
+        ),
+    )
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Time the core kernels over a sweep of sizes and compare them against a stored baseline."
+    )
+
+    parser.add_argument(
+        "cases",
+        metavar="PATTERN",
+        nargs="*",
+        help="Only run the cases whose names contain one of these, e.g. 'run/' or 'w1024'.",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Runs per case, of which the fastest is kept. (Default: {})".format(
+            DEFAULT_REPEAT
+        ),
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        metavar="T",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Fractional slowdown over the baseline counted as a regression. (Default: {})".format(
+            DEFAULT_TOLERANCE
+        ),
+    )
+
+    parser.add_argument(
+        "--baseline",
+        metavar="B",
+        type=str,
+        default=BASELINE_FILE,
+        help="Baseline JSON file. (Default: {})".format(os.path.relpath(BASELINE_FILE)),
+    )
+
+    parser.add_argument(
+        "--updateBaseline",
+        action="store_true",
+        default=False,
+        help="Store the timings of the cases run as the new baseline instead of comparing.",
+    )
+
+    parser.add_argument(
+        "--list", action="store_true", default=False, help="List the cases and exit."
+    )
+
+    args = parser.parse_args()
+
+    if args.list:
+        for name in kernel_cases():
+            print(name)
+        return
+
+    baseline = load_baseline(args.baseline)
+    results = OrderedDict()
+    regressions = 0
+    for name, seconds in benchmark(args.cases, args.repeat):
+        results[name] = seconds
+        status, line = compare(name, seconds, baseline, args.tolerance)
+        print(line, flush=True)
+        regressions += status == "REGRESSION"
+
+    if args.updateBaseline:
+        write_baseline(results, args.baseline)
+        return
+
+    if regressions:
+        print("{} cases regressed beyond {:.0%}".format(regressions, args.tolerance))
+        exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,120 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+EXAMPLES = os.path.join(os.path.dirname(MAIN), "examples")
+DEFAULT_REPEAT = 5
+
+# Cold startup budgets in seconds for each subcommand, including the few
+# milliseconds of actual work
+STARTUP_BUDGETS = {
+    "help": 0.5,
+    "convert_png": 0.6,
+    "generate_json": 0.6,
+    "generate_midi": 0.6,
+    "learn_json": 0.6,
+    "convert_midi": 1.5,
+    "learn_midi": 1.5,
+}
+
+# Example files copied into the working directory of the benchmark
+EXAMPLE_FILES = {
+    "image.png": "images/r_060.rule.json.tendril.png",
+    "song.midi": "midi/chpn_op10_e01.midi",
+    "rule.json": "rules/eca_8bit/r_030.rule.json",
+    "states.json": "midi/chpn_op10_e01.midi.tendril_states.json",
+    "seed.json": "seeds/seed_32x1_1bit_active.json",
+}
+
+SUBCOMMANDS = {
+    "help": ["--help"],
+    "convert_png": ["--convert", "image.png"],
+    "generate_json": ["--generateFrom", "rule.json", "--seed", "seed.json", "--json"],
+    "generate_midi": ["--generateFrom", "rule.json", "--seed", "seed.json", "--midi"],
+    "learn_json": ["--learn", "states.json"],
+    "convert_midi": ["--convert", "song.midi"],
+    "learn_midi": ["--learn", "song.midi"],
+}
+
+
+def time_subcommand(args, cwd, repeat=DEFAULT_REPEAT):
+    """
+    Return the fastest wall time of repeat fresh interpreter runs of main.py
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.run(
+            [sys.executable, MAIN] + args,
+            cwd=cwd,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(names=None, repeat=DEFAULT_REPEAT):
+    """
+    Time each subcommand against its budget, returning (name, seconds, budget) rows
+    """
+    cwd = tempfile.mkdtemp(prefix="tendril_startup_")
+    try:
+        for f_name, example in EXAMPLE_FILES.items():
+            shutil.copy(os.path.join(EXAMPLES, example), os.path.join(cwd, f_name))
+        results = []
+        for name in names or SUBCOMMANDS:
+            seconds = time_subcommand(SUBCOMMANDS[name], cwd, repeat)
+            results.append((name, seconds, STARTUP_BUDGETS[name]))
+        return results
+    finally:
+        shutil.rmtree(cwd)
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Check the cold startup time of CLI subcommands against budgets."
+    )
+
+    parser.add_argument(
+        "subcommands",
+        metavar="NAME",
+        nargs="*",
+        help="Subcommands to time. (Options: {})".format(list(SUBCOMMANDS)),
+    )
+
+    parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Runs per subcommand, of which the fastest is kept. (Default: {})".format(
+            DEFAULT_REPEAT
+        ),
+    )
+
+    args = parser.parse_args()
+
+    over_budget = 0
+    for name, seconds, budget in benchmark(args.subcommands, args.repeat):
+        status = "ok"
+        if seconds > budget:
+            status = "OVER BUDGET"
+            over_budget += 1
+        print("{}: {:.3f}s (budget {:.3f}s) {}".format(name, seconds, budget, status))
+
+    if over_budget:
+        print("{} subcommands over budget".format(over_budget))
+        exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,8 +1,9 @@
+import hashlib
+import os
+from collections import OrderedDict, namedtuple
 import numpy as np
-from scipy.ndimage import convolve
-from bits import uint8_tuple_to_bin_arr, encode_state
+from profiling import count, stage
 from math import log, floor
-from PIL import Image
 import bitarray
 
 DEFAULT_SEQUENCE_STEPS = 96
@@ -12,11 +13,31 @@ DEFAULT_SEED[floor(DEFAULT_SEED_SHAPE[0] / 2)] = 1  # Activate a single middle b
 
 DEFAULT_PHI = np.array([1, 10, 100])  # A generic 3x1 conv kernel to be used as phi
 
+COMPILED_RULE_CACHE_SIZE = 256
+# States per block yielded by run_stream
+DEFAULT_BLOCK_SIZE = 1024
+
+# Rules with base-2 neighborhood codes, rather than the decimal digits of tens().
+# Rules of cells with n states use base-n codes, e.g. "base3".
+BASE2_ENCODING = "base2"
+TENS_ENCODING = "tens"
+# Larger radii are learned as sparse base-2 rules by default
+MAX_TENS_RADIUS = 3
+# Larger radii run on lookup tables instead of bitwise multiplexers
+MAX_MUX_RADIUS = 3
+
+CompiledRule = namedtuple(
+    "CompiledRule",
+    ["lut", "kernel", "kernel_radius", "dont_ignore_odd", "program", "cell_states"],
+)
+
 
 def wrapped_convolver(x, k):
     """
     Default lambda that applies a convolution "wrapped"
     """
+    from scipy.ndimage import convolve
+
     x_next = convolve(x, k, mode="wrap")
     x_norm = np.linalg.norm(x_next)
     if x_norm == 0:
@@ -41,12 +62,468 @@ def tens(n):
     return ns
 
 
+def neighborhood_codes(x, kernel_radius=1, cell_states=2):
+    """
+    Encode the neighborhood of every cell as a base-2 integer, or base-n for cells
+    with n states
+
+    The cell at offset d from the center carries the weight 2^(r + d), so code i is the
+    i-th bit of a rule number.  Cells beyond the edges are 0, like
+    the "constant" mode convolution used by eca.  x may be a single state or a 2-D
+    array with one state per row.
+    """
+    x = np.asarray(x)
+    width = x.shape[-1]
+    padded = np.zeros(x.shape[:-1] + (width + 2 * kernel_radius,), dtype=np.intp)
+    padded[..., kernel_radius : kernel_radius + width] = x
+    codes = padded[..., 0:width].copy()
+    for p in range(1, (kernel_radius * 2) + 1):
+        codes += padded[..., p : p + width] * (cell_states ** p)
+    return codes
+
+
+def base_kernel(kernel_radius, cell_states=2):
+    """
+    Return the weights of the cells of a neighborhood in base-n codes, left to right
+    """
+    return [cell_states ** p for p in range((kernel_radius * 2) + 1)]
+
+
+def base_encoding(cell_states=2):
+    return "base{}".format(cell_states)
+
+
+def rule_cell_states(rule):
+    """
+    Return the number of cell states of a rule, 2 unless its codes are base-n
+    """
+    encoding = rule.get("encoding", TENS_ENCODING)
+    if encoding == TENS_ENCODING:
+        return 2
+    return int(encoding[len("base") :])
+
+
+def rule_codes(rule):
+    """
+    Return the base-n neighborhood code of every entry of a rule's k_states
+    """
+    if rule.get("encoding", TENS_ENCODING) != TENS_ENCODING:
+        return np.asarray(rule["k_states"], dtype=np.intp)
+
+    # k_states hold the neighborhood bits as decimal digits, lowest digit first,
+    # i.e. "110" -> 0b011
+    k_len = len(rule["k"])
+    return np.array(
+        [int(str(int(ks)).zfill(k_len)[::-1], 2) for ks in rule["k_states"]],
+        dtype=np.intp,
+    )
+
+
+def compile_rule(rule, dont_ignore_odd=False):
+    """
+    Compile a rule dictionary into a lookup table indexed by neighborhood code, along
+    with the multiplexer program used by run_packed
+
+    Neighborhoods missing from the k_states of sparse rules map to 0.
+    """
+    k_len = len(rule["k"])
+    cell_states = rule_cell_states(rule)
+    lut = np.zeros((cell_states ** k_len,), dtype=np.uint8)
+    lut[rule_codes(rule)] = np.asarray(rule["rule"], dtype=np.uint8)
+
+    # Same policy as eca callers: prevent [0,0,0] -> 1 transitions
+    if not dont_ignore_odd:
+        lut[0] = 0
+
+    return compiled_rule_from_lut(lut, rule["k"], dont_ignore_odd, cell_states)
+
+
+def compiled_rule_from_lut(lut, kernel, dont_ignore_odd=False, cell_states=2):
+    kernel_radius = (len(kernel) - 1) // 2
+    program = None
+    # Only binary cells can be packed into bits
+    if cell_states == 2 and kernel_radius <= MAX_MUX_RADIUS:
+        program = mux_program(lut)
+    return CompiledRule(
+        lut=lut,
+        kernel=np.asarray(kernel),
+        kernel_radius=kernel_radius,
+        dont_ignore_odd=dont_ignore_odd,
+        program=program,
+        cell_states=cell_states,
+    )
+
+
+def rule_key(rule, dont_ignore_odd=False):
+    """
+    Hash the contents of a rule dictionary, so equal rules share a key wherever they
+    were loaded from
+    """
+    h = hashlib.sha1()
+    h.update(rule.get("encoding", TENS_ENCODING).encode("utf-8"))
+    h.update(np.asarray(rule["k"], dtype=np.int64).tobytes())
+    h.update(np.array(list(map(int, rule["k_states"])), dtype=np.int64).tobytes())
+    h.update(np.asarray(rule["rule"], dtype=np.uint8).tobytes())
+    h.update(b"odd" if dont_ignore_odd else b"even")
+    return h.hexdigest()
+
+
+class CompiledRuleCache:
+    """
+    Bounded LRU cache of compiled rules keyed by rule contents
+
+    With a cache_dir, lookup tables are also saved there as .npy files and loaded
+    instead of compiling the rule again in later processes.
+    """
+
+    def __init__(self, max_size=COMPILED_RULE_CACHE_SIZE, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.rules = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rule, dont_ignore_odd=False):
+        key = rule_key(rule, dont_ignore_odd)
+        if key in self.rules:
+            self.hits += 1
+            self.rules.move_to_end(key)
+            return self.rules[key]
+
+        self.misses += 1
+        compiled = self._load(key, rule, dont_ignore_odd)
+        if compiled is None:
+            compiled = compile_rule(rule, dont_ignore_odd)
+            self._save(key, compiled)
+
+        self.rules[key] = compiled
+        if len(self.rules) > self.max_size:
+            self.rules.popitem(last=False)
+        return compiled
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "{}.npy".format(key))
+
+    def _load(self, key, rule, dont_ignore_odd):
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        return compiled_rule_from_lut(
+            np.load(self._path(key)), rule["k"], dont_ignore_odd, rule_cell_states(rule)
+        )
+
+    def _save(self, key, compiled):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.save(self._path(key), compiled.lut)
+
+    def clear(self):
+        self.rules.clear()
+
+
+COMPILED_RULE_CACHE = CompiledRuleCache()
+
+
+def get_compiled_rule(rule, dont_ignore_odd=False):
+    """
+    Compile a rule through the module-wide cache
+    """
+    return COMPILED_RULE_CACHE.get(rule, dont_ignore_odd)
+
+
+def tile_cycle(states, steps, transient, period):
+    """
+    Extend the states simulated up to the first repeat to steps + 1 states by
+    repeating the cycle
+    """
+    # state t repeats state t - period for every t past the transient
+    idx = np.arange(steps + 1)
+    tail = idx[len(states) :]
+    idx[len(states) :] = transient + ((tail - transient) % period)
+    return states[idx]
+
+
+def lut_step(state, out, lut, padded, codes, kernel_radius=1, cell_states=2):
+    """
+    Write the state following state into out, using padded and codes as scratch
+    arrays of the padded width and the width
+    """
+    width = len(state)
+    padded[kernel_radius : kernel_radius + width] = state
+    codes[:] = padded[0:width]
+    for p in range(1, (kernel_radius * 2) + 1):
+        codes += padded[p : p + width] * (cell_states ** p)
+    np.take(lut, codes, out=out)
+
+
+def run_lut(steps, seed, lut, kernel_radius=1, detect_cycles=False, cell_states=2):
+    """
+    Evolve a seed with a compiled rule, returning a (steps + 1, width) array
+
+    detect_cycles works as in run_packed.
+    """
+    width = len(seed)
+    states = np.zeros((steps + 1, width), dtype=np.uint8)
+    states[0] = seed
+    padded = np.zeros((width + 2 * kernel_radius,), dtype=np.intp)
+    codes = np.zeros((width,), dtype=np.intp)
+    # step at which each state was first seen
+    seen = {states[0].tobytes(): 0}
+    transient = None
+    period = None
+    for i in range(steps):
+        lut_step(
+            states[i], states[i + 1], lut, padded, codes, kernel_radius, cell_states
+        )
+        if detect_cycles:
+            key = states[i + 1].tobytes()
+            if key in seen:
+                transient = seen[key]
+                period = i + 1 - transient
+                break
+            seen[key] = i + 1
+
+    if not detect_cycles:
+        return states
+    if period is not None:
+        states = tile_cycle(
+            states[0 : transient + period + 1], steps, transient, period
+        )
+    return states, {"transient": transient, "period": period}
+
+
+def run_lut_batch(
+    steps, seeds, luts, rule_idx, kernel_radius=1, packed=False, cell_states=2
+):
+    """
+    Evolve a (B, width) batch of seeds together, row b using the table luts[rule_idx[b]]
+
+    Returns a (B, steps + 1, width) array, or with packed=True the same array with
+    each state bit-packed along the width axis, for binary cells only.
+    """
+    seeds = np.asarray(seeds)
+    batch, width = seeds.shape
+    n_codes = luts.shape[1]
+    flat_luts = np.ascontiguousarray(luts, dtype=np.uint8).ravel()
+    offsets = (np.asarray(rule_idx, dtype=np.intp) * n_codes)[:, None]
+
+    if packed:
+        states = np.zeros((batch, steps + 1, (width + 7) // 8), dtype=np.uint8)
+        states[:, 0] = np.packbits(seeds.astype(bool), axis=-1)
+    else:
+        states = np.zeros((batch, steps + 1, width), dtype=np.uint8)
+        states[:, 0] = seeds
+
+    x = seeds.astype(np.uint8)
+    padded = np.zeros((batch, width + 2 * kernel_radius), dtype=np.intp)
+    codes = np.zeros((batch, width), dtype=np.intp)
+    for i in range(steps):
+        padded[:, kernel_radius : kernel_radius + width] = x
+        codes[:] = padded[:, 0:width]
+        for p in range(1, (kernel_radius * 2) + 1):
+            codes += padded[:, p : p + width] * (cell_states ** p)
+        codes += offsets
+        np.take(flat_luts, codes, out=x)
+        if packed:
+            states[:, i + 1] = np.packbits(x.astype(bool), axis=-1)
+        else:
+            states[:, i + 1] = x
+    return states
+
+
+def run_batch(
+    rules, seeds, steps=DEFAULT_SEQUENCE_STEPS, dont_ignore_odd=False, packed=False
+):
+    """
+    Evolve N rules from M seeds as one (N * M, width) batch
+
+    Row n * M + m of the result holds rule n evolved from seed m.  All rules must share
+    a kernel radius and number of cell states, and all seeds a width.
+    """
+    compiled = [get_compiled_rule(rule, dont_ignore_odd) for rule in rules]
+    radii = set(c.kernel_radius for c in compiled)
+    if len(radii) != 1:
+        raise ValueError(
+            "Rules in a batch must share one kernel radius, got {}".format(radii)
+        )
+    cell_states = set(c.cell_states for c in compiled)
+    if len(cell_states) != 1:
+        raise ValueError(
+            "Rules in a batch must share one number of cell states, got {}".format(
+                cell_states
+            )
+        )
+
+    luts = np.stack([c.lut for c in compiled])
+    seeds = np.atleast_2d(seeds)
+    n = len(luts)
+    m = len(seeds)
+
+    rule_idx = np.repeat(np.arange(n), m)
+    batch_seeds = np.tile(seeds, (n, 1))
+    return run_lut_batch(
+        steps, batch_seeds, luts, rule_idx, radii.pop(), packed, cell_states.pop()
+    )
+
+
+def mux_program(lut):
+    """
+    Compile a binary lookup table into a multiplexer tree over neighborhood bits
+
+    Each op (p, hi, lo) selects the value in slot hi where neighbor bit p is set and
+    the value in slot lo elsewhere, storing the result in the next free slot.  Slots 0
+    and 1 hold the constant 0 and 1 states, and the last op produces the next state.
+    """
+    ops = []
+    slots = {}
+
+    def node(sub, p):
+        if not np.any(sub):
+            return 0
+        if np.all(sub):
+            return 1
+        half = len(sub) // 2
+        hi = node(sub[half:], p - 1)
+        lo = node(sub[:half], p - 1)
+        key = (p, hi, lo)
+        if key not in slots:
+            ops.append(key)
+            slots[key] = len(ops) + 1
+        return slots[key]
+
+    root = node(np.asarray(lut), int(log(len(lut), 2)) - 1)
+    return ops, root
+
+
+def pack_seed(seed):
+    """
+    Pack a binary seed into an integer, with bit j holding cell j
+    """
+    packed = np.packbits(np.asarray(seed, dtype=bool), bitorder="little")
+    return int.from_bytes(packed.tobytes(), "little")
+
+
+def unpack_states(packed, width):
+    """
+    Unpack a list of little-endian packed state bytes into a (len(packed), width) array
+    """
+    n_bytes = (width + 7) // 8
+    rows = np.frombuffer(b"".join(packed), dtype=np.uint8).reshape(-1, n_bytes)
+    return np.unpackbits(rows, axis=1, bitorder="little")[:, 0:width]
+
+
+def packed_steps(x, width, kernel_radius, program):
+    """
+    Yield the packed states following the packed state x, without end
+    """
+    mask = (1 << width) - 1
+    ops, root = program
+    while True:
+        # bit j of neighbors[p] is the cell at j + p - r
+        neighbors = [(x << (kernel_radius - p)) & mask for p in range(kernel_radius)]
+        for p in range(kernel_radius, (kernel_radius * 2) + 1):
+            neighbors.append(x >> (p - kernel_radius))
+        vals = [0, mask]
+        for p, hi, lo in ops:
+            n = neighbors[p]
+            a = vals[hi]
+            b = vals[lo]
+            if a == mask and b == 0:
+                vals.append(n)
+            elif a == 0 and b == mask:
+                vals.append(n ^ mask)
+            else:
+                vals.append(b ^ ((a ^ b) & n))
+        x = vals[root]
+        yield x
+
+
+def run_packed(steps, seed, lut, kernel_radius=1, detect_cycles=False, program=None):
+    """
+    Evolve a binary seed with a compiled rule using bitwise operations on the state
+    packed into a single integer.  Returns a (steps + 1, width) array like run_lut.
+
+    With detect_cycles, simulation stops at the first repeated state and the rest of
+    the states are tiled from the cycle.  Returns the states and a dict with the
+    transient length and period, which are None when no state repeats.
+
+    program is the mux_program of lut, compiled here when not given.
+    """
+    width = len(seed)
+    n_bytes = (width + 7) // 8
+    if program is None:
+        program = mux_program(lut)
+
+    x = pack_seed(seed)
+    packed = [x.to_bytes(n_bytes, "little")]
+    # step at which each state was first seen
+    seen = {x: 0}
+    transient = None
+    period = None
+    for i, x in zip(range(steps), packed_steps(x, width, kernel_radius, program)):
+        packed.append(x.to_bytes(n_bytes, "little"))
+        if detect_cycles:
+            if x in seen:
+                transient = seen[x]
+                period = i + 1 - transient
+                break
+            seen[x] = i + 1
+
+    states = unpack_states(packed, width)
+    if not detect_cycles:
+        return states
+
+    if period is not None:
+        states = tile_cycle(states, steps, transient, period)
+    return states, {"transient": transient, "period": period}
+
+
 def run(
     steps=DEFAULT_SEQUENCE_STEPS,
     seed=DEFAULT_SEED,
     kernel=DEFAULT_PHI,
     f=wrapped_convolver,
+    rule=None,
+    dont_ignore_odd=False,
+    detect_cycles=False,
 ):
+    # Rule dictionaries use the bit-packed engine instead of f, or lookup tables for
+    # kernels too wide for it
+    if rule is not None:
+        with stage("compile_rule"):
+            compiled = get_compiled_rule(rule, dont_ignore_odd)
+        with stage("simulate"):
+            if compiled.program is None:
+                result = run_lut(
+                    steps,
+                    seed,
+                    compiled.lut,
+                    compiled.kernel_radius,
+                    detect_cycles=detect_cycles,
+                    cell_states=compiled.cell_states,
+                )
+            else:
+                result = run_packed(
+                    steps,
+                    seed,
+                    compiled.lut,
+                    compiled.kernel_radius,
+                    detect_cycles=detect_cycles,
+                    program=compiled.program,
+                )
+            simulated = steps
+            if detect_cycles and result[1]["period"] is not None:
+                # the states after the first cycle are tiled, not simulated
+                simulated = min(steps, result[1]["transient"] + result[1]["period"])
+            count("steps_simulated", simulated)
+            count("cells_updated", simulated * len(seed))
+        if detect_cycles:
+            states, cycle = result
+            return list(states), cycle
+        return list(result)
+    if detect_cycles:
+        raise ValueError("Cycle detection needs a rule")
+
     results = [seed]
     a_b = np.copy(seed)
     # print("{}: {}".format(0, seed))
@@ -58,8 +535,82 @@ def run(
     return results
 
 
-def image_from_states(states, f_name, max_height=64):
-    mat = np.array(np.uint8(np.logical_not(states[0:max_height])) * 255)
+def stream_packed(seed, kernel_radius, program, block_size=DEFAULT_BLOCK_SIZE):
+    width = len(seed)
+    n_bytes = (width + 7) // 8
+    x = pack_seed(seed)
+    packed = [x.to_bytes(n_bytes, "little")]
+    steps = packed_steps(x, width, kernel_radius, program)
+    while True:
+        while len(packed) < block_size:
+            packed.append(next(steps).to_bytes(n_bytes, "little"))
+        yield unpack_states(packed, width)
+        packed = []
+
+
+def stream_lut(seed, lut, kernel_radius, cell_states, block_size=DEFAULT_BLOCK_SIZE):
+    width = len(seed)
+    padded = np.zeros((width + 2 * kernel_radius,), dtype=np.intp)
+    codes = np.zeros((width,), dtype=np.intp)
+    block = np.zeros((block_size, width), dtype=np.uint8)
+    block[0] = seed
+    while True:
+        for i in range(1, block_size):
+            lut_step(
+                block[i - 1], block[i], lut, padded, codes, kernel_radius, cell_states
+            )
+        yield block
+        last = block[-1]
+        block = np.zeros((block_size, width), dtype=np.uint8)
+        lut_step(last, block[0], lut, padded, codes, kernel_radius, cell_states)
+
+
+def run_stream(
+    steps=None,
+    seed=DEFAULT_SEED,
+    rule=None,
+    dont_ignore_odd=False,
+    block_size=DEFAULT_BLOCK_SIZE,
+):
+    """
+    Evolve a seed with a rule dictionary, yielding (block_size, width) arrays of
+    consecutive states as they are simulated, the last block possibly shorter
+
+    The blocks hold the same steps + 1 states as run, or continue without end when
+    steps is None, so long sequences can be consumed in constant memory.
+    """
+    with stage("compile_rule"):
+        compiled = get_compiled_rule(rule, dont_ignore_odd)
+    if compiled.program is None:
+        blocks = stream_lut(
+            seed, compiled.lut, compiled.kernel_radius, compiled.cell_states, block_size
+        )
+    else:
+        blocks = stream_packed(
+            seed, compiled.kernel_radius, compiled.program, block_size
+        )
+
+    remaining = None if steps is None else steps + 1
+    # the first block starts with the seed, which isn't simulated
+    seeded = 1
+    while remaining is None or remaining > 0:
+        with stage("simulate"):
+            block = next(blocks)
+            if remaining is not None:
+                block = block[0:remaining]
+                remaining -= len(block)
+            count("steps_simulated", len(block) - seeded)
+            count("cells_updated", (len(block) - seeded) * block.shape[1])
+            seeded = 0
+        yield block
+
+
+def image_from_states(states, f_name, max_height=64, cell_states=2):
+    from PIL import Image
+
+    # live cells are black, shading lighter for lower states of multi-state cells
+    levels = np.asarray(states[0:max_height]) / (cell_states - 1)
+    mat = np.uint8(np.round((1 - levels) * 255))
     im = Image.fromarray(mat, mode="L")
     print("saving image: ", f_name)
     im.save(f_name)
@@ -74,130 +625,240 @@ def eca(x, k, r_set):
     a: activation
     k_states: kernel combination space
     """
+    from scipy.ndimage import convolve
+
     x_next = convolve(x, k, mode="constant", cval=0.0)
     matches = np.isin(x_next, r_set)
     result = np.where(matches, 1, 0)
     return result
 
 
-def learn_rules_from_states(states, kernel_radius=1, debug=False):
+class RuleLearner:
     """
-    CARLA algorithm applied to the sequence of states
-    """
-    # generate a kernel based on radius
-    k_len = (kernel_radius * 2) + 1
-    # kernel = primes(k_len)
-    k = tens(k_len)
-
-    num_bits_kernel = 2 ** (len(k))
-
-    k_states = [uint8_tuple_to_bin_arr((i,)) for i in range(0, num_bits_kernel)]
-    k_states_trimmed = list(
-        map(lambda x: x[-int(log(num_bits_kernel, 2)) :], [x for x in k_states])
-    )
-    k_states_trimmed.reverse()  # sort by sums
-    if debug:
-        print("k_space_size: ", len(k_states))
+    Accumulates the transition counts of the CARLA algorithm so a rule can be learned
+    from states delivered in chunks, merged across workers and saved between runs
 
-    k_states = list(map(lambda x: np.dot(k, x), k_states_trimmed))
-
-    # the maximum length of the rule, aka 2^(len(k))
-    activations_search_space_size = 2 ** num_bits_kernel
+    Counts are only kept for observed neighborhoods, so memory scales with the
+    observed patterns rather than the n^(2r+1) neighborhoods of the kernel.
+    """
 
-    if debug:
-        print("rule_space_size: ", activations_search_space_size)
-
-    # print("k_states: ", k_states)
-    # only track non-zero
-    counts_dict = {}
-    # for key in k_states:
-    # count number of next states, 0 = Falses, 1 = Trues
-    # counts_dict[key] = [0, 0]
-
-    # 1. iterate over all states learning transitions
-    n = len(states)
-    for i in range(n - 1):
-        x = states[i]
-        x_plus_1 = states[i + 1]
-        # Apply kernel to x
-        x_pattern = convolve(x, k, mode="constant")
-        # compare patterns to next state value
-        for j in range(len(x)):
-            x_patt_i = x_pattern[j]  # pattern encoding
-            # print("x_patt_i", x_patt_i)
-            rule_str = str(int(x_patt_i))
-            x_plus_1_j = int(x_plus_1[j])  # next transition
-            # print("r({}) {} -> {}: ".format(rule_str, x_patt_i, x_plus_1_j))
-            # return
-            if rule_str in counts_dict:
-                counts_dict[rule_str][x_plus_1_j] = (
-                    counts_dict[rule_str][x_plus_1_j] + 1
+    def __init__(self, kernel_radius=1, cell_states=2):
+        self.kernel_radius = kernel_radius
+        self.cell_states = cell_states
+        # next state counts by base-n neighborhood code, in order of appearance
+        self.counts = {}
+        # number of cells in each state
+        self.state_counts = [0] * cell_states
+        self.last_state = None
+
+    @property
+    def occurences(self):
+        return sum(self.state_counts)
+
+    @property
+    def population(self):
+        # i.e. number of alive cells
+        return self.occurences - self.state_counts[0]
+
+    def update(self, states):
+        """
+        Count the transitions of a chunk continuing the current sequence
+        """
+        states = np.asarray(states).astype(np.intp)
+        if not len(states):
+            return self
+
+        state_counts = np.bincount(states.ravel(), minlength=self.cell_states)
+        if len(state_counts) > self.cell_states:
+            raise ValueError(
+                "States have values above {} cell states".format(self.cell_states)
+            )
+        for s in range(self.cell_states):
+            self.state_counts[s] += int(state_counts[s])
+
+        # carry the transition across the chunk boundary
+        if self.last_state is not None:
+            states = np.concatenate([self.last_state[None], states])
+        self.last_state = states[-1].copy()
+
+        if len(states) > 1:
+            n = self.cell_states
+            count("transitions_counted", (len(states) - 1) * states.shape[1])
+            codes = neighborhood_codes(states[0:-1], self.kernel_radius, n)
+            transitions = ((codes * n) + states[1:]).ravel()
+            observed, first_seen, counts = np.unique(
+                transitions, return_index=True, return_counts=True
+            )
+            for i in np.argsort(first_seen):
+                code = int(observed[i] // n)
+                if code not in self.counts:
+                    self.counts[code] = [0] * n
+                self.counts[code][observed[i] % n] += int(counts[i])
+        return self
+
+    def end_sequence(self):
+        """
+        Start a new sequence, so no transition is counted into the next chunk
+        """
+        self.last_state = None
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another learner, e.g. from a parallel worker
+        """
+        if (other.kernel_radius, other.cell_states) != (
+            self.kernel_radius,
+            self.cell_states,
+        ):
+            raise ValueError(
+                "Cannot merge kernel radius {} with {} cell states into {} with {}".format(
+                    other.kernel_radius,
+                    other.cell_states,
+                    self.kernel_radius,
+                    self.cell_states,
                 )
+            )
+        for code, v in other.counts.items():
+            if code not in self.counts:
+                self.counts[code] = [0] * self.cell_states
+            for s in range(self.cell_states):
+                self.counts[code][s] += v[s]
+        for s in range(self.cell_states):
+            self.state_counts[s] += other.state_counts[s]
+        return self
+
+    def finalize(self, debug=False, encoding=None):
+        """
+        Match the counted transitions with a rule in rulespace
+
+        With the base-2 encoding, the rule is sparse and only lists the observed
+        neighborhoods.  The encoding defaults to tens() codes for radii up to
+        MAX_TENS_RADIUS and base-2 codes beyond.  Cells with n states always use
+        base-n codes.
+        """
+        if encoding is None:
+            if self.kernel_radius > MAX_TENS_RADIUS:
+                encoding = BASE2_ENCODING
             else:
-                counts = [0, 0]
-                counts[x_plus_1_j] = 1
-                counts_dict[rule_str] = counts
-
-        # Find match for x-pattern
-
-    # create a dictionary of likelihood value will be 1
-    rule = {}
-    targets = {}
-    state_size = len(states[0])
-    population = np.sum(np.array(states))  # i.e. number of alive cells
-    occurences = n * len(states[0])
-    if debug:
-        print(counts_dict)
-
-    # the minimum probability to mark rule
-    prob_floor = 0.0000
-    for n in counts_dict:
-        v = counts_dict[n]
-        # rule[n] = np.float64(v[1]) / np.sum(v, dtype=np.float64)
-        prob_1 = np.float64(v[1]) / population
-        prob_0 = np.float64(v[0]) / (occurences - population)
-        target = 0
-        if prob_1 > prob_0:
-            prob = prob_1
-            target = 1
+                encoding = TENS_ENCODING
+        if self.cell_states != 2 or encoding != TENS_ENCODING:
+            encoding = base_encoding(self.cell_states)
+        is_tens = encoding == TENS_ENCODING
+
+        k_len = (self.kernel_radius * 2) + 1
+        if is_tens:
+            k = tens(k_len)
+            k_states = generate_k_states_from_k_radius(self.kernel_radius)
         else:
-            prob = prob_0
+            k = base_kernel(self.kernel_radius, self.cell_states)
+            k_states = list(self.counts)
+
+        if debug:
+            print("k_space_size: ", self.cell_states ** k_len)
+            print("observed_k_states: ", len(self.counts))
+
+        # only track non-zero, keyed by the pattern encoding
+        counts_dict = {}
+        for code, v in self.counts.items():
+            if is_tens:
+                rule_str = str(int(format(code, "0{}b".format(k_len))[::-1]))
+            else:
+                rule_str = str(code)
+            counts_dict[rule_str] = v
+
+        # create a dictionary of likelihood value will be 1
+        rule = {}
+        targets = {}
+        state_counts = self.state_counts
+        if debug:
+            print(counts_dict)
+
+        def state_prob(v, s):
+            # states that never occur are never a next state either
+            if not state_counts[s]:
+                return np.float64(0.0)
+            return np.float64(v[s]) / state_counts[s]
+
+        # the minimum probability to mark rule
+        prob_floor = 0.0000
+        for n in counts_dict:
+            v = counts_dict[n]
+            # the most likely next state, relative to how common each state is
             target = 0
-        # assign the prob
-        if prob > prob_floor:
-            rule[n] = prob
-            targets[n] = target
-    # Match with rule in rulespace
-    a = []
-    for ks in k_states:
-        rule_str = str(ks)
-        # print("rule_str: ", rule_str)
-        if rule_str in rule:
-            t = targets[rule_str]
-            # print("t:", t)
-            a.append(t)
+            prob = state_prob(v, 0)
+            for s in range(1, self.cell_states):
+                prob_s = state_prob(v, s)
+                if prob_s > prob:
+                    prob = prob_s
+                    target = s
+            # assign the prob
+            if prob > prob_floor:
+                rule[n] = prob
+                targets[n] = target
+        # Match with rule in rulespace
+        a = []
+        for ks in k_states:
+            rule_str = str(ks)
+            if rule_str in rule:
+                a.append(targets[rule_str])
+            else:
+                a.append(0)
+        rule_dict = {"k": k, "rule": a, "k_states": k_states, "confidence_scores": rule}
+        if not is_tens:
+            rule_dict["encoding"] = encoding
+            rule_dict["kernel_radius"] = self.kernel_radius
+        return rule_dict
+
+    def to_dict(self):
+        last_state = self.last_state
+        if last_state is not None:
+            last_state = last_state.astype(int).tolist()
+        return {
+            "kernel_radius": self.kernel_radius,
+            "cell_states": self.cell_states,
+            "counts": {str(code): v for code, v in self.counts.items()},
+            "state_counts": self.state_counts,
+            "population": self.population,
+            "occurences": self.occurences,
+            "last_state": last_state,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        learner = cls(d["kernel_radius"], d.get("cell_states", 2))
+        for code, v in d["counts"].items():
+            learner.counts[int(code)] = list(v)
+        if "state_counts" in d:
+            learner.state_counts = list(d["state_counts"])
         else:
-            a.append(0)
-    # print("a:", a, "rule:", rule)
-    return {"k": k, "rule": a, "k_states": k_states, "confidence_scores": rule}
-
-
-def generate_k_states_from_k_radius(kernel_radius):
-    k_len = (kernel_radius * 2) + 1
-    # kernel = primes(k_len)
-    k = tens(k_len)
+            # binary counts files only record the population
+            learner.state_counts = [d["occurences"] - d["population"], d["population"]]
+        if d["last_state"] is not None:
+            learner.last_state = np.array(d["last_state"])
+        return learner
 
-    num_bits_kernel = 2 ** (len(k))
 
-    k_states = [uint8_tuple_to_bin_arr((i,)) for i in range(0, num_bits_kernel)]
-    k_states_trimmed = list(
-        map(lambda x: x[-int(log(num_bits_kernel, 2)) :], [x for x in k_states])
-    )
-    k_states_trimmed.reverse()  # sort by sums
+def learn_rules_from_states(
+    states, kernel_radius=1, debug=False, encoding=None, cell_states=2
+):
+    """
+    CARLA algorithm applied to the sequence of states
+    """
+    learner = RuleLearner(kernel_radius, cell_states)
+    learner.update(states)
+    return learner.finalize(debug, encoding)
 
-    k_states = list(map(lambda x: np.dot(k, x), k_states_trimmed))
 
-    return k_states
+def generate_k_states_from_k_radius(kernel_radius):
+    """
+    Return every neighborhood as its tens() code, from neighborhood 2^(2r+1) - 1 down
+    to 0, e.g. [111, 11, 101, 1, 110, 10, 100, 0] for radius 1
+    """
+    k_len = (kernel_radius * 2) + 1
+    fmt = "0{}b".format(k_len)
+    # the cell weighted 10^p is bit p of the neighborhood
+    return [int(format(i, fmt)[::-1]) for i in reversed(range(2 ** k_len))]
 
 
 def generate_rule_from_k_states(k_states, kernel_radius, rule_number: int, debug=False):
@@ -205,7 +866,7 @@ def generate_rule_from_k_states(k_states, kernel_radius, rule_number: int, debug
     k = tens(k_len)
     expected_activation_size = 2 ** k_len  # for 2-state cells
     # Parse bit number
-    fmt = str(expected_activation_size).zfill(3) + "b"
+    fmt = "0{}b".format(expected_activation_size)
     bit_str = format(rule_number, fmt)
 
     activation = np.array(bitarray.bitarray(bit_str).tolist()).astype(int).tolist()
@@ -1,17 +1,32 @@
-from PIL import Image
 import numpy as np
 import os
 import math
 
-from midi import write_states_to_file, convert_midi_to_state, write_rule_to_json
-from ca import generate_k_states_from_k_radius, generate_rule_from_k_states
+from rulebank import iter_rules_for_k, write_rule_bank
+from statefile import STATES_FILE_EXT, StatesWriter
+
+DEFAULT_PNG_THRESHOLD = 0  # black
+PNG_BLOCK_ROWS = 1024
+
 
 # TODO: add 12-tone normalize
-def convert(f_name):
+def convert(f_name, binary=False, threshold=DEFAULT_PNG_THRESHOLD):
+    from midi import write_states_to_file, convert_midi_to_state
+
     _, ext = os.path.splitext(f_name)
+
+    # Write states to json, or bit-packed binary
+    states_file = "{f_name}.{ext}".format(
+        f_name=(f_name + ".training_states"), ext=STATES_FILE_EXT if binary else "json"
+    )
+
     states = None
     if ext == ".png":
-        states = convert_png_to_states(f_name)
+        if binary:
+            # Stream blocks of rows straight into the states file
+            write_png_to_states_file(f_name, states_file, threshold)
+            return
+        states = convert_png_to_states(f_name, threshold)
     elif ext in [".mid", ".midi"]:
         states = convert_midi_to_state(
             f_name,
@@ -25,39 +40,55 @@ def convert(f_name):
         print("Unsupported file extension: {}".format(ext))
         exit(1)
 
-    if not states:
+    if states is None or not len(states):
         print("No states can be derived from {}".format(f_name))
         print("Please ensure this file is supported.")
         exit(1)
 
-    # Write states to json
-    json_states_file = "{f_name}.{ext}".format(
-        f_name=(f_name + ".training_states"), ext="json"
-    )
+    write_states_to_file(states, states_file, {"source": f_name})
+
 
-    write_states_to_file(states, json_states_file)
+def iter_png_state_blocks(
+    f_name, threshold=DEFAULT_PNG_THRESHOLD, block_rows=PNG_BLOCK_ROWS
+):
+    """
+    Threshold an image into states, block_rows rows at a time
 
+    Pixels at or below threshold are alive.  Images with several channels are
+    thresholded on their luminance.  PIL can't decode part of a PNG, so the decoded
+    image is held whole and memory grows with its height; only the luminance and
+    states are made a block at a time.
+    """
+    from PIL import Image
 
-def convert_png_to_states(f_name):
     im = Image.open(f_name)
-    im_arr = np.array(im)
-    states = []
-    ALIVE = 0  # black
-    DEAD = 255  # white
-    # arr = im_arr[im_arr_zeros].astype(int)
-    # print(im_arr)
-    for row in im_arr:
-        state = np.zeros((len(row),), dtype=int)
-        for i in range(len(row)):
-            el = row[i]
-            if el == ALIVE:
-                state[i] = 1
-        states.append(state)
-        print(state)
-    return states
-
-
-def generate_all_rules_for_k(out_dir="", k_radius=None, debug=False):
+    width, height = im.size
+    for top in range(0, height, block_rows):
+        # the first crop decodes the whole image, later ones reuse it
+        block = im.crop((0, top, width, min(top + block_rows, height)))
+        if block.mode != "L":
+            block = block.convert("L")
+        yield np.uint8(np.asarray(block) <= threshold)
+
+
+def convert_png_to_states(f_name, threshold=DEFAULT_PNG_THRESHOLD):
+    return np.concatenate(list(iter_png_state_blocks(f_name, threshold)))
+
+
+def write_png_to_states_file(f_name, states_file, threshold=DEFAULT_PNG_THRESHOLD):
+    from PIL import Image
+
+    width, _ = Image.open(f_name).size
+    with StatesWriter(states_file, width, {"source": f_name}) as writer:
+        for block in iter_png_state_blocks(f_name, threshold):
+            writer.write(block)
+
+    print("writing states to file: ", states_file)
+
+
+def generate_all_rules_for_k(
+    out_dir="", k_radius=None, debug=False, bank=False, rule_range=None
+):
     n = 2  # number of states per cell
     k_len = (k_radius * 2) + 1
     activation_size = n ** k_len
@@ -68,21 +99,29 @@ def generate_all_rules_for_k(out_dir="", k_radius=None, debug=False):
             k_radius, activation_size, num_rules, k_len
         )
     )
+
+    start, stop = rule_range or (0, num_rules)
     # # max int rules
-    if k_len >= 5:
+    if k_len >= 5 and rule_range is None:
         print(
             "Warning: large rule space selected {}.  Consider selecting a smaller rule space.".format(
                 k_len
             )
         )
 
-    k_states = generate_k_states_from_k_radius(k_radius)
+    rules = iter_rules_for_k(k_radius, start, stop)
+
+    if bank:
+        f_name = "{}/r_k{}_{}_{}.bank.bin".format(out_dir, k_radius, start, stop)
+        write_rule_bank(f_name, k_radius, rules, debug=debug, start=start)
+        return
+
+    from midi import write_rule_to_json
 
     digits_to_pad = math.ceil(math.log(num_rules, 10))
-    for r in range(0, num_rules):
+    for r, rule in enumerate(rules, start):
         if debug:
             print("Computing rule: {}".format(r))
-        rule = generate_rule_from_k_states(k_states, k_radius, r, debug=debug)
         r_str = str(r).zfill(digits_to_pad)
         f_name = "{}/r_{}".format(out_dir, r_str)
         write_rule_to_json(rule, f_name, debug)
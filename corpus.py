@@ -0,0 +1,226 @@
+import glob
+import json
+import os
+import time
+from functools import partial
+from multiprocessing import Pool, current_process
+
+from midi import (
+    get_learner,
+    learn_states,
+    read_training_states,
+    write_counts_to_file,
+    write_rule_to_json,
+)
+from profiling import count, stage
+from statefile import STATES_FILE_EXT, is_states_file
+
+MIDI_EXTS = (".mid", ".midi")
+# files generated from rules, which are not learned from
+GENERATED_EXTS = (
+    ".tendril.mid",
+    ".tendril_states.json",
+    ".tendril_states." + STATES_FILE_EXT,
+)
+# states converted from a MIDI file, named after it
+TRAINING_STATES_EXTS = (".training_states.json", ".training_states." + STATES_FILE_EXT)
+GLOB_CHARS = "*?["
+
+
+def is_corpus(f_name):
+    """
+    Whether --learn was given a directory or glob of files rather than one file
+    """
+    return os.path.isdir(f_name) or any(c in f_name for c in GLOB_CHARS)
+
+
+def is_json_states_file(f_name):
+    """
+    Whether a JSON file holds states, rather than e.g. a rule, counts or stats
+    """
+    try:
+        with open(f_name, "r") as json_file:
+            d = json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return False
+    return isinstance(d, dict) and "states" in d
+
+
+def is_training_file(f_name):
+    """
+    Whether a file of a glob is one to learn from: a MIDI, binary states or JSON
+    states file that wasn't generated from a rule
+    """
+    if f_name.endswith(GENERATED_EXTS):
+        return False
+    if f_name.endswith(MIDI_EXTS):
+        return True
+    if f_name.endswith(".json"):
+        return is_json_states_file(f_name)
+    return is_states_file(f_name)
+
+
+def corpus_files(f_name):
+    """
+    Return the files of a corpus in sorted order
+
+    A directory means every MIDI file in it but the generated ones, and a glob every
+    MIDI, binary states or JSON states file it matches but the generated ones.  States
+    converted from a MIDI file that is also matched are skipped, so the piece is only
+    learned once.
+    """
+    if os.path.isdir(f_name):
+        files = [
+            os.path.join(f_name, name)
+            for name in os.listdir(f_name)
+            if name.endswith(MIDI_EXTS) and not name.endswith(GENERATED_EXTS)
+        ]
+    else:
+        files = [name for name in glob.glob(f_name) if is_training_file(name)]
+        matched = set(files)
+        files = [
+            name
+            for name in files
+            if not any(
+                name.endswith(ext) and name[0 : -len(ext)] in matched
+                for ext in TRAINING_STATES_EXTS
+            )
+        ]
+    return sorted(files)
+
+
+def corpus_name(f_name):
+    """
+    Return the path the files learned from a corpus are named after, i.e. the
+    directory itself, or corpus in the directory of a glob
+    """
+    if os.path.isdir(f_name):
+        return f_name.rstrip(os.sep) or os.sep
+    return os.path.join(os.path.dirname(f_name) or ".", "corpus")
+
+
+def learn_corpus_file(
+    f_name,
+    scale_type="maj",
+    k_radius=1,
+    cell_states=2,
+    save_json=False,
+    save_binary=False,
+):
+    """
+    Count the transitions of one file of a corpus, returning its learner and stats
+    """
+    start = time.time()
+    states, file_cell_states = read_training_states(
+        f_name,
+        scale_type,
+        save_json=save_json,
+        save_binary=save_binary,
+        cell_states=cell_states,
+    )
+    if file_cell_states != cell_states:
+        raise ValueError(
+            "{} has {} cell states, not {}".format(
+                f_name, file_cell_states, cell_states
+            )
+        )
+    learner = learn_states(get_learner(None, k_radius, cell_states), states)
+    return (
+        learner,
+        {
+            "file": f_name,
+            "states": len(states),
+            "cells": learner.occurences,
+            "neighborhoods": len(learner.counts),
+            "density": learner.population / max(learner.occurences, 1),
+            "seconds": time.time() - start,
+        },
+    )
+
+
+def learn_rule_from_corpus(
+    f_name,
+    scale_type="maj",
+    k_radius=1,
+    workers=None,
+    save_json=False,
+    save_binary=False,
+    counts_file=None,
+    encoding=None,
+    cell_states=2,
+):
+    """
+    Learn one rule from every file of a corpus, reading and counting files on a
+    process pool
+
+    Transitions are counted per file, so none crosses from the end of one file into
+    the next, and the counts are merged in file order.  Writes the rule and the stats
+    of every file next to corpus_name(f_name), and returns them.
+    """
+    files = corpus_files(f_name)
+    if not files:
+        print("No files to learn from in: {}".format(f_name))
+        exit(1)
+    name = corpus_name(f_name)
+    workers = min(workers or os.cpu_count(), len(files))
+    if current_process().daemon:
+        # e.g. a --batch job, whose pool workers can't start a pool of their own
+        workers = 1
+
+    learn_file = partial(
+        learn_corpus_file,
+        scale_type=scale_type,
+        k_radius=k_radius,
+        cell_states=cell_states,
+        save_json=save_json,
+        save_binary=save_binary,
+    )
+    learner = get_learner(counts_file, k_radius, cell_states)
+    file_stats = []
+
+    def merge(result):
+        file_learner, stats = result
+        learner.merge(file_learner)
+        file_stats.append(stats)
+        count("files_learned")
+        print(
+            "{file}: {states} states, {neighborhoods} neighborhoods, "
+            "{seconds:.3f}s".format(**stats)
+        )
+
+    start = time.time()
+    with stage("learn"):
+        if workers == 1:
+            for f in files:
+                merge(learn_file(f))
+        else:
+            with Pool(workers) as pool:
+                for result in pool.imap(learn_file, files):
+                    merge(result)
+
+        if counts_file:
+            write_counts_to_file(learner, counts_file)
+        rule = learner.finalize(encoding=encoding)
+    seconds = time.time() - start
+
+    print(
+        "learned from {} files, {} states in {:.3f}s on {} workers".format(
+            len(files), sum(s["states"] for s in file_stats), seconds, workers
+        )
+    )
+    write_rule_to_json(rule, name)
+
+    stats_file = "{}.corpus_stats.json".format(name)
+    with open(stats_file, "w") as json_file:
+        json.dump(
+            {
+                "files": file_stats,
+                "neighborhoods": len(learner.counts),
+                "seconds": seconds,
+                "workers": workers,
+            },
+            json_file,
+            indent=2,
+        )
+    print("writing corpus stats to: {}".format(stats_file))
+    return rule, file_stats
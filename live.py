@@ -0,0 +1,246 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import sampling
+from ca import DEFAULT_SEED, rule_cell_states, run_stream
+from midiwriter import (
+    DEFAULT_RESOLUTION,
+    DEFAULT_TEMPO,
+    DEFAULT_VELOCITY,
+    DRUM_CHANNEL,
+    NOTE_OFF,
+    NOTE_ON,
+    PROGRAM_CHANGE,
+    StatesTrack,
+)
+from profiling import count
+
+DEFAULT_LOOKAHEAD = 4  # states computed ahead of the one playing
+MISSED_DEADLINE = 0.005  # seconds late at which a step counts as a missed deadline
+SPIN_TIME = 0.002  # seconds before a deadline at which sleeping turns to busy-waiting
+SWITCH_INTERVAL = 0.0005  # GIL switch interval while playing, to wake on time
+CONTROL_CHANGE = 0xB0
+ALL_NOTES_OFF = 123
+
+
+class MidiStreamWriter:
+    """
+    Collects the note events of a StatesTrack as raw MIDI messages, to be sent when
+    their ticks come up
+    """
+
+    def __init__(self):
+        self.events = deque()
+        self.channel = 0
+
+    def begin_track(self, name="", program=0, is_drum=False):
+        self.channel = DRUM_CHANNEL if is_drum else 0
+        self.events.append((0, bytes([PROGRAM_CHANGE | self.channel, program])))
+
+    def note_on(self, tick, pitch, velocity=DEFAULT_VELOCITY):
+        self.events.append((tick, bytes([NOTE_ON | self.channel, pitch, velocity])))
+
+    def note_off(self, tick, pitch):
+        self.events.append((tick, bytes([NOTE_OFF | self.channel, pitch, 0])))
+
+    def end_track(self):
+        pass
+
+    def pop_until(self, tick):
+        """
+        Remove and return the events before tick, in order
+        """
+        events = []
+        while self.events and self.events[0][0] < tick:
+            events.append(self.events.popleft())
+        return events
+
+    def all_notes_off(self):
+        return bytes([CONTROL_CHANGE | self.channel, ALL_NOTES_OFF, 0])
+
+
+class TempoScheduler:
+    """
+    Waits for the deadline of each tick at a fixed tempo, recording how late every
+    step starts
+    """
+
+    def __init__(self, bpm=DEFAULT_TEMPO):
+        self.seconds_per_tick = 60.0 / (bpm * DEFAULT_RESOLUTION)
+        self.start_time = None
+        self.lateness = []
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def wait(self, tick):
+        """
+        Sleep until the deadline of tick, then return how many seconds late it is
+        """
+        deadline = self.start_time + tick * self.seconds_per_tick
+        remaining = deadline - time.perf_counter()
+        if remaining > SPIN_TIME:
+            time.sleep(remaining - SPIN_TIME)
+        # sleep overshoots by up to a millisecond or so, so spin for the rest
+        while time.perf_counter() < deadline:
+            pass
+        return time.perf_counter() - deadline
+
+    def wait_step(self, tick):
+        late = self.wait(tick)
+        self.lateness.append(late)
+        return late
+
+    def report(self):
+        lateness = np.array(self.lateness) * 1000
+        if not len(lateness):
+            lateness = np.zeros(1)
+        return {
+            "steps": len(self.lateness),
+            "mean_jitter_ms": float(np.mean(lateness)),
+            "p99_jitter_ms": float(np.percentile(lateness, 99)),
+            "max_jitter_ms": float(np.max(lateness)),
+            "missed_deadlines": int(np.sum(lateness > MISSED_DEADLINE * 1000)),
+        }
+
+
+def open_output(path):
+    """
+    Open a path, named pipe or file descriptor number for writing, returning the file
+    descriptor.  "-" is standard output.
+    """
+    if path == "-":
+        return sys.stdout.fileno()
+    if path.isdigit():
+        return int(path)
+    # Opening a named pipe waits for a reader
+    return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+
+def compute_ahead(states, ahead, stop):
+    """
+    Put each state on the ahead queue, blocking while it is full, then None
+    """
+    try:
+        for state in states:
+            while not stop.is_set():
+                try:
+                    ahead.put(state, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+        ahead.put(None)
+    except Exception as e:
+        ahead.put(e)
+
+
+def play_live(
+    path,
+    rule,
+    seed=[],
+    scale=None,
+    steps=None,
+    beat_duration=8,
+    bpm=DEFAULT_TEMPO,
+    sampler_name=None,
+    voices=sampling.DEFAULT_VOICES,
+    random_seed=None,
+    dont_ignore_odd=False,
+    lookahead=DEFAULT_LOOKAHEAD,
+    program=0,
+):
+    """
+    Play the states of a rule as raw MIDI messages written to path at a tempo
+
+    A thread computes states at most lookahead steps ahead of playback, so state t + 1
+    is computed while state t plays.  Notes are timed as in the MIDI file of the same
+    states.  Runs for steps states, or until interrupted when steps is None, and
+    returns the jitter of the start of every step.
+    """
+    if not len(seed):
+        seed = DEFAULT_SEED
+    if scale is None:
+        from midi import get_scale
+
+        scale = get_scale()
+    scale = np.asarray(scale)[0 : len(seed)]
+
+    blocks = run_stream(steps, seed, rule, dont_ignore_odd, block_size=lookahead)
+    if sampler_name:
+        rng = np.random.default_rng(random_seed)
+        blocks = sampling.sample_blocks(blocks, sampler_name, voices, rng)
+    states = (state for block in blocks for state in block)
+
+    ahead = queue.Queue(maxsize=lookahead)
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=compute_ahead, args=(states, ahead, stop), daemon=True
+    )
+
+    writer = MidiStreamWriter()
+    track = StatesTrack(
+        writer,
+        scale,
+        beat_duration,
+        program=program,
+        cell_states=rule_cell_states(rule),
+    )
+    scheduler = TempoScheduler(bpm)
+    fd = open_output(path)
+    # keep messages out of the MIDI bytes when those go to standard output
+    log = sys.stderr if path == "-" else sys.stdout
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(SWITCH_INTERVAL)
+    producer.start()
+    try:
+        # Wait for the first state, so compiling the rule doesn't count as late
+        first = ahead.get()
+        scheduler.start()
+        state = first
+        t = 0
+        while state is not None and (steps is None or t < steps):
+            if isinstance(state, Exception):
+                raise state
+            track.write([state])
+            scheduler.wait_step(t * beat_duration)
+            # the events of a step run until the next one starts
+            for tick, message in writer.pop_until((t + 1) * beat_duration):
+                scheduler.wait(tick)
+                os.write(fd, message)
+            t += 1
+            state = ahead.get()
+        track.close()
+        for tick, message in writer.pop_until(float("inf")):
+            scheduler.wait(tick)
+            os.write(fd, message)
+    except KeyboardInterrupt:
+        # silence whatever is still sounding
+        os.write(fd, writer.all_notes_off())
+        if steps is not None:
+            raise
+    except BrokenPipeError:
+        # the reader went away, so there is no one left to play to
+        print("output closed after {} steps".format(len(scheduler.lateness)), file=log)
+    finally:
+        stop.set()
+        sys.setswitchinterval(switch_interval)
+        if path != "-" and not path.isdigit():
+            os.close(fd)
+
+    report = scheduler.report()
+    count("missed_deadlines", report["missed_deadlines"])
+    print(
+        "played {steps} steps, jitter mean {mean_jitter_ms:.3f}ms, "
+        "p99 {p99_jitter_ms:.3f}ms, max {max_jitter_ms:.3f}ms, "
+        "{missed_deadlines} missed deadlines".format(**report),
+        file=log,
+    )
+    return report
@@ -1,21 +1,26 @@
 import argparse
+import sys
 
 from midi import (
     learn_rule_from_file,
     generate_states_from_rule_and_seed,
     get_rule_from_file,
     get_seed_from_file,
+    get_scale,
     DEFAULT_BEAT_DURATION,
     DEFAULT_SEQUENCE_STEPS,
 )
-from ca import DEFAULT_SEED
-from convert import convert, generate_all_rules_for_k
+from ca import BASE2_ENCODING, COMPILED_RULE_CACHE, DEFAULT_SEED, MAX_TENS_RADIUS
+from midiwriter import DEFAULT_RESOLUTION, DEFAULT_TEMPO
+from corpus import corpus_name, is_corpus, learn_rule_from_corpus
+from convert import convert, generate_all_rules_for_k, DEFAULT_PNG_THRESHOLD
 import sampling
 
 
-def cli():
-    DEFAULT_OUTDIR = "."
+DEFAULT_OUTDIR = "."
 
+
+def build_parser():
     parser = argparse.ArgumentParser(
         description="Learn cellular automata from sequences and generate new sequences."
     )
@@ -47,12 +52,46 @@ def cli():
         help="Save MIDI of the generated states.",
     )
 
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        default=False,
+        help="Save states as a bit-packed binary file instead of JSON.",
+    )
+
     parser.add_argument(
         "--learn",
         metavar="S",
         type=str,
         default=None,
-        help="Create a rule file from a sequence provided as JSON or MIDI.",
+        help="Create a rule file from a sequence provided as JSON, binary states or MIDI, or from every file of a directory of MIDI files or a quoted glob, read on --workers processes.",
+    )
+
+    parser.add_argument(
+        "--encoding",
+        metavar="E",
+        type=str,
+        choices=["tens", BASE2_ENCODING],
+        default=None,
+        help="Neighborhood encoding of learned rules, either 'tens' or sparse '{}'. (Default: '{}' beyond kernel radius {})".format(
+            BASE2_ENCODING, BASE2_ENCODING, MAX_TENS_RADIUS
+        ),
+    )
+
+    parser.add_argument(
+        "--cellStates",
+        metavar="N",
+        type=int,
+        default=2,
+        help="Number of cell states when learning, with MIDI velocities quantized to states 1 to N - 1. (Default: 2)",
+    )
+
+    parser.add_argument(
+        "--counts",
+        metavar="C",
+        type=str,
+        default=None,
+        help="Add the learned transitions to a JSON counts file, creating it if missing, and learn the rule from all counts in it.",
     )
 
     parser.add_argument(
@@ -60,7 +99,7 @@ def cli():
         metavar="R",
         type=str,
         default=None,
-        help="Generate a new sequence from a provided JSON Rulefile.",
+        help="Generate a new sequence from a provided JSON Rulefile or a rule bank entry, e.g. bank.bin#1234.",
     )
 
     parser.add_argument(
@@ -77,6 +116,21 @@ def cli():
         help="Generate all rules for a given set of ECA parameters and dump json to outdir.",
     )
 
+    parser.add_argument(
+        "--ruleBank",
+        default=False,
+        action="store_true",
+        help="With --generateAllRules, write a single binary rule bank instead of one JSON file per rule.",
+    )
+
+    parser.add_argument(
+        "--ruleRange",
+        metavar="A:B",
+        type=str,
+        default=None,
+        help="With --generateAllRules, only generate rule numbers A to B (exclusive).",
+    )
+
     parser.add_argument(
         "--convert",
         metavar="S",
@@ -85,6 +139,16 @@ def cli():
         help="Convert a target file from png, midi to states.json format",
     )
 
+    parser.add_argument(
+        "--threshold",
+        metavar="T",
+        type=int,
+        default=DEFAULT_PNG_THRESHOLD,
+        help="With --convert, PNG pixels at or below this value are alive cells. (Default: {})".format(
+            DEFAULT_PNG_THRESHOLD
+        ),
+    )
+
     parser.add_argument(
         "--seed",
         metavar="S",
@@ -152,6 +216,24 @@ def cli():
         ),
     )
 
+    parser.add_argument(
+        "--voices",
+        metavar="V",
+        type=int,
+        default=sampling.DEFAULT_VOICES,
+        help="The number of voices followed by the sampler. (Default: {})".format(
+            sampling.DEFAULT_VOICES
+        ),
+    )
+
+    parser.add_argument(
+        "--randomSeed",
+        metavar="RS",
+        type=int,
+        default=None,
+        help="Seed for the random choices of the sampler.",
+    )
+
     parser.add_argument(
         "--dontIgnoreOdd",
         action="store_true",
@@ -159,8 +241,125 @@ def cli():
         help="Do not ignore the odd-numbered bit when present in rule.",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--ruleCacheDir",
+        metavar="DIR",
+        type=str,
+        default=None,
+        help="Directory where compiled rules are cached between runs.",
+    )
+
+    parser.add_argument(
+        "--detectCycles",
+        action="store_true",
+        default=False,
+        help="Stop simulating at the first repeated state and repeat its cycle for the remaining steps.",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=False,
+        help="Simulate and write generated states in blocks, in constant memory. With --steps 0, generate until interrupted.",
+    )
+
+    parser.add_argument(
+        "--live",
+        metavar="PATH",
+        type=str,
+        default=None,
+        help="Play generated states as raw MIDI messages written to a file, named pipe, file descriptor number or '-' for stdout, at --bpm. With --steps 0, play until interrupted.",
+    )
+
+    parser.add_argument(
+        "--bpm",
+        metavar="BPM",
+        type=float,
+        default=DEFAULT_TEMPO,
+        help="Tempo of --live playback, with --beatDuration ticks of 1/{} beat per state. (Default: {})".format(
+            DEFAULT_RESOLUTION, DEFAULT_TEMPO
+        ),
+    )
+
+    parser.add_argument(
+        "--batch",
+        metavar="M",
+        type=str,
+        default=None,
+        help="Run the learn, generate and convert jobs of a JSON manifest on a process pool.",
+    )
+
+    parser.add_argument(
+        "--tracks",
+        metavar="T",
+        type=str,
+        default=None,
+        help="Generate one multi-track MIDI file from a JSON list of tracks, each with its own rule, seed, scale and sampler.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        metavar="W",
+        type=int,
+        default=None,
+        help="Number of worker processes for --batch, --tracks or --learn of a corpus. (Default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Record the time, peak memory and counters of each pipeline stage in a JSON report next to the outputs.",
+    )
+
+    parser.add_argument(
+        "--profileStage",
+        metavar="STAGE",
+        type=str,
+        default=None,
+        help="With --profile, also write a cProfile dump of one stage, e.g. 'simulate' or 'learn'.",
+    )
+
+    parser.add_argument(
+        "--connect",
+        metavar="SOCKET",
+        type=str,
+        default=None,
+        help="Forward this command to a daemon started with `main.py serve SOCKET`.",
+    )
 
+    return parser
+
+
+def profile_file(args):
+    """
+    Return the path of the profile report, next to the outputs of the command
+    """
+    f_name = args.learn or args.convert or args.tracks or args.batch
+    if args.learn and is_corpus(args.learn):
+        f_name = corpus_name(args.learn)
+    if not f_name and args.generateFrom:
+        f_name = args.generateFrom.replace("#", ".r_")
+    return "{}.profile.json".format(f_name or "tendril")
+
+
+def execute(args, get_rule=get_rule_from_file, get_seed=get_seed_from_file):
+    """
+    Run the commands of parsed CLI arguments, profiling them with --profile
+
+    get_rule and get_seed load rules and seeds from their paths, so a long-running
+    process can serve them from a cache.
+    """
+    if args.profile:
+        from profiling import profile
+
+        with profile(profile_file(args), args.profileStage):
+            run_commands(args, get_rule, get_seed)
+    else:
+        run_commands(args, get_rule, get_seed)
+
+
+def run_commands(args, get_rule=get_rule_from_file, get_seed=get_seed_from_file):
     # Store as variables for chaining
     rule = None
     f_name = None
@@ -170,9 +369,29 @@ def cli():
     if args.debug:
         debug_mode = True
 
+    if args.ruleCacheDir:
+        COMPILED_RULE_CACHE.cache_dir = args.ruleCacheDir
+
+    if args.batch:
+        from batch import run_manifest
+
+        summary = run_manifest(args.batch, workers=args.workers, debug=debug_mode)
+        exit(int(summary["failed"] > 0))
+
+    if args.tracks:
+        from tracks import generate_tracks
+
+        generate_tracks(
+            args.tracks,
+            steps=args.steps,
+            beat_duration=args.beatDuration,
+            workers=args.workers,
+        )
+        exit()
+
     # Just a simple conversion
     if args.convert:
-        convert(args.convert)
+        convert(args.convert, binary=args.binary, threshold=args.threshold)
         exit()
 
     if args.generateAllRules:
@@ -181,11 +400,31 @@ def cli():
         else:
             print("--kernelRadius is required to generate rules")
             exit(1)
+        rule_range = None
+        if args.ruleRange:
+            rule_range = tuple(map(int, args.ruleRange.split(":")))
         generate_all_rules_for_k(
-            out_dir=args.generateAllRules, k_radius=k_radius, debug=args.debug
+            out_dir=args.generateAllRules,
+            k_radius=k_radius,
+            debug=args.debug,
+            bank=args.ruleBank,
+            rule_range=rule_range,
         )
 
-    if args.learn:
+    if args.learn and is_corpus(args.learn):
+        f_name = corpus_name(args.learn)
+        rule, file_stats = learn_rule_from_corpus(
+            args.learn,
+            scale_type=args.scaleType,
+            k_radius=args.kernelRadius,
+            workers=args.workers,
+            save_json=args.json,
+            save_binary=args.binary,
+            counts_file=args.counts,
+            encoding=args.encoding,
+            cell_states=args.cellStates,
+        )
+    elif args.learn:
         f_name = args.learn
         rule, states = learn_rule_from_file(
             args.learn,
@@ -193,7 +432,11 @@ def cli():
             scale_type=args.scaleType,
             k_radius=args.kernelRadius,
             save_json=args.json,
+            save_binary=args.binary,
             debug=debug_mode,
+            counts_file=args.counts,
+            encoding=args.encoding,
+            cell_states=args.cellStates,
         )
 
     if args.generate or args.generateFrom:
@@ -205,7 +448,7 @@ def cli():
 
         if args.seed:
             # Get seed from file
-            seed = get_seed_from_file(args.seed)
+            seed = get_seed(args.seed)
         else:
             seed = DEFAULT_SEED
 
@@ -215,16 +458,42 @@ def cli():
                 print("Rule must be provided from file or learned.")
                 exit(1)
             # Get rule from file
-            rule = get_rule_from_file(args.generateFrom)
+            rule = get_rule(args.generateFrom)
 
         if not f_name:
-            f_name = args.generateFrom
+            # i.e. bank.bin#1234 -> bank.bin.r_1234
+            f_name = args.generateFrom.replace("#", ".r_")
+
+        steps = args.steps
+        if (args.stream or args.live) and steps <= 0:
+            steps = None
+        if args.stream and args.detectCycles:
+            print("--detectCycles can't be combined with --stream")
+            exit(1)
 
         if debug_mode:
             print("f_name: ", f_name)
             print("using seed: ", seed)
             print("using rule: ", rule)
 
+        if args.live:
+            from live import play_live
+
+            play_live(
+                args.live,
+                rule,
+                seed=seed,
+                scale=get_scale(args.scaleNum, args.scaleType),
+                steps=steps,
+                beat_duration=args.beatDuration,
+                bpm=args.bpm,
+                sampler_name=args.sampler,
+                voices=args.voices,
+                random_seed=args.randomSeed,
+                dont_ignore_odd=args.dontIgnoreOdd,
+            )
+            return
+
         # If not chaining
         generate_states_from_rule_and_seed(
             f_name=f_name,
@@ -235,13 +504,37 @@ def cli():
             save_png=args.png,
             save_json=args.json,
             save_midi=args.midi,
+            save_binary=args.binary,
             sampler_name=args.sampler,
-            steps=args.steps,
+            steps=steps,
             beat_duration=args.beatDuration,
             dont_ignore_odd=args.dontIgnoreOdd,
+            detect_cycles=args.detectCycles,
+            voices=args.voices,
+            random_seed=args.randomSeed,
+            stream=args.stream,
         )
 
 
+def cli(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] == "serve":
+        from server import DEFAULT_SOCKET, serve
+
+        serve(argv[1] if len(argv) > 1 else DEFAULT_SOCKET)
+        return
+
+    args = build_parser().parse_args(argv)
+    if args.connect:
+        from server import forward
+
+        exit(forward(args.connect, argv))
+
+    execute(args)
+
+
 if __name__ == "__main__":
     # Run in CLI mode
     cli()
@@ -1,44 +1,73 @@
 # External modules
-from pypianoroll import Multitrack, Track, load
+from contextlib import ExitStack
 from math import log, floor
 import numpy as np
 import json
+import os
 import sampling
 
 # Internal modules
 from ca import (
     print_states,
-    learn_rules_from_states,
+    RuleLearner,
     run,
-    eca,
+    run_stream,
+    DEFAULT_BLOCK_SIZE,
     DEFAULT_SEQUENCE_STEPS,
     image_from_states,
+    rule_cell_states,
     DEFAULT_SEED,
 )
-from stats import metrics
+from stats import StatesCounter, metrics
+from profiling import stage
+from rulebank import get_rule_from_bank, is_rule_bank, split_rule_ref
+from midiwriter import (
+    MidiFileWriter,
+    StatesTrack,
+    state_velocities,
+    write_midi_from_states,
+)
+from statefile import (
+    STATES_FILE_EXT,
+    StatesFile,
+    StatesWriter,
+    is_states_file,
+    write_states_file,
+)
 from scales import MAJ_SCALES_MIDI_NOTES, MIN_SCALES_MIDI_NOTES, CHROMATIC_SCALE
 
 DEFAULT_BEAT_DURATION = 8
 
 
-def get_seed_from_file(f_name):
+def get_seeds_from_file(f_name):
+    """
+    Read every seed in a seed file as a (M, width) array
+    """
     seed_file_dict = {}
     with open(f_name, "r") as json_file:
         seed_file_dict = json.load(json_file)
 
-    seed = np.array(seed_file_dict["seed"])
+    return np.atleast_2d(np.array(seed_file_dict["seed"]))
 
-    # Case 1: 2-d or >
-    if len(seed.shape) > 1:
-        # Choose a random row from seed matrix
-        idx = np.random.randint(0, len(seed))
-        return seed[idx]
-    # Case 2: 1-d
-    else:
-        return seed
+
+def get_seed_from_file(f_name):
+    return choose_seed(get_seeds_from_file(f_name))
+
+
+def choose_seed(seeds):
+    if len(seeds) == 1:
+        return seeds[0]
+
+    # Choose a random row from seed matrix
+    idx = np.random.randint(0, len(seeds))
+    return seeds[idx]
 
 
 def get_rule_from_file(f_name):
+    # Rule banks are referenced as bank.bin#1234
+    if split_rule_ref(f_name)[1] is not None or is_rule_bank(f_name):
+        return get_rule_from_bank(f_name)
+
     rule_file_dict = {}
     with open(f_name, "r") as json_file:
         rule_file_dict = json.load(json_file)
@@ -48,12 +77,17 @@ def get_rule_from_file(f_name):
     k_states = np.array(list(map(int, rule_file_dict["k_states"])))
     confidence_scores = rule_file_dict["confidence_scores"]
     # TODO: add coocurrence table for each state
-    return {
+    rule_dict = {
         "k": k,
         "rule": rule,
         "k_states": k_states,
         "confidence_scores": confidence_scores,
     }
+    # Sparse rules with base-2 neighborhood codes
+    if "encoding" in rule_file_dict:
+        rule_dict["encoding"] = rule_file_dict["encoding"]
+        rule_dict["kernel_radius"] = rule_file_dict["kernel_radius"]
+    return rule_dict
 
 
 def squash_state_to_scale(state, sc_mask):
@@ -70,15 +104,17 @@ def generate_pianoroll(
     steps=DEFAULT_SEQUENCE_STEPS,
     beat_duration=DEFAULT_BEAT_DURATION,
     scale=MAJ_SCALES_MIDI_NOTES[0],
+    cell_states=2,
 ):
     pianoroll = np.zeros((steps * beat_duration, 128))
+    velocities = state_velocities(cell_states)
 
     for t in range(steps):
-        state = states[t]
-        beat = scale * np.array(state)
+        state = np.asarray(states[t]).astype(int)
+        beat = scale * (state > 0)
         beat_list = beat.astype(int).tolist()
         beat_idx = t * beat_duration
-        pianoroll[beat_idx, beat_list] = 100
+        pianoroll[beat_idx, beat_list] = velocities[state]
 
     # Clear 0s
     pianoroll[0 : (steps * beat_duration), 0] = 0
@@ -87,21 +123,23 @@ def generate_pianoroll(
 
 
 def squash_piano_roll_to_chromatic_frames(states):
-    width = len(states[0])
+    """
+    Stack the frames of every whole octave, lowest octave first, as 12-wide frames
+    """
+    states_arr = np.asarray(states)
+    height, width = states_arr.shape
     state_slices = floor(width / 12)
-    slices = []
-    states_arr = np.array(states)
-    for i in range(state_slices):
-        l = i * 12
-        r = l + 12
-        slices.append(states_arr[:, l:r])
-    s_compressed = np.concatenate(slices)
-    return s_compressed
+    octaves = states_arr[:, 0 : state_slices * 12].reshape(height, state_slices, 12)
+    return octaves.transpose(1, 0, 2).reshape(state_slices * height, 12)
+
 
+def write_states_to_file(states, f_name, provenance=None):
+    # Bit-packed binary states
+    if f_name.endswith("." + STATES_FILE_EXT):
+        write_states_file(states, f_name, provenance)
+        print("writing states to file: ", f_name)
+        return
 
-def write_states_to_file(states, f_name):
-    # print(states)
-    # exit(1)
     states_dict = {"states": [np.array(s).astype(int).tolist() for s in states]}
 
     with open(f_name, "w") as json_file:
@@ -110,6 +148,37 @@ def write_states_to_file(states, f_name):
     print("writing states to file: ", f_name)
 
 
+class JSONStatesWriter:
+    """
+    Writes states to a JSON states file a block of states at a time, in the same
+    format as json.dump of {"states": [...]}
+    """
+
+    def __init__(self, f_name):
+        self.json_file = open(f_name, "w")
+        self.json_file.write('{"states": [')
+        self.empty = True
+
+    def write(self, states):
+        rows = [json.dumps(row) for row in np.asarray(states).astype(int).tolist()]
+        if not rows:
+            return
+        if not self.empty:
+            self.json_file.write(", ")
+        self.json_file.write(", ".join(rows))
+        self.empty = False
+
+    def close(self):
+        self.json_file.write("]}")
+        self.json_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def write_files_from_states(
     states,
     metrics,
@@ -122,23 +191,55 @@ def write_files_from_states(
     beat_duration=DEFAULT_BEAT_DURATION,
     save_json=False,
     save_midi=False,
+    save_binary=False,
     debug=False,
+    scale=None,
+    cell_states=2,
 ):
-    # TODO: make it possible to alter parameters more easily
-    pianoroll = g(states, steps, beat_duration)
-
-    # Create a `pypianoroll.Track` instance
-    track = Track(pianoroll=pianoroll, program=0, is_drum=False, name=title)
-
-    mt = Multitrack(tracks=[track])
-
     mid_file = "{f_name}.tendril.{ext}".format(f_name=f_name, ext="mid")
     json_file = "{f_name}.tendril_states.{ext}".format(f_name=f_name, ext="json")
 
     # Write MIDI file
     if save_midi:
         print("writing midi file to: ", mid_file)
-        mt.write(mid_file)
+        if scale is not None:
+            # Stream note events straight from the states
+            with stage("write_midi"):
+                write_midi_from_states(
+                    mid_file,
+                    states,
+                    scale,
+                    steps,
+                    beat_duration,
+                    name=title,
+                    cell_states=cell_states,
+                )
+        else:
+            # TODO: make it possible to alter parameters more easily
+            with stage("pianoroll"):
+                pianoroll = g(states, steps, beat_duration, cell_states=cell_states)
+
+            # pypianoroll is only needed for the pianoroll path, so import it here
+            from pypianoroll import Multitrack, Track
+
+            # Create a `pypianoroll.Track` instance
+            track = Track(pianoroll=pianoroll, program=0, is_drum=False, name=title)
+
+            with stage("write_midi"):
+                mt = Multitrack(tracks=[track])
+                mt.write(mid_file)
+
+    # Write binary states file instead of JSON
+    if save_binary:
+        bin_file = "{f_name}.tendril_states.{ext}".format(
+            f_name=f_name, ext=STATES_FILE_EXT
+        )
+        print("writing tendril states to: {}".format(bin_file))
+        with stage("write_states"):
+            write_states_file(
+                states, bin_file, {"source": f_name, "steps": steps}, cell_states
+            )
+        return
 
     # Write JSON file
     states_serialized = [np.int32(s).tolist() for s in states]
@@ -148,8 +249,9 @@ def write_files_from_states(
     if json_file:
         print("writing tendril states to: {}".format(json_file))
         # Save state info as json_file
-        with open(json_file, "w") as json_file:
-            json.dump(states_dict, json_file)
+        with stage("write_states"):
+            with open(json_file, "w") as json_file:
+                json.dump(states_dict, json_file)
 
 
 def convert_midi_to_state(
@@ -159,6 +261,8 @@ def convert_midi_to_state(
     twelve_tone_normalize=True,
     save_midi=False,
     save_json=False,
+    save_binary=False,
+    cell_states=2,
 ):
     is_midi = f_name.endswith(".mid") or f_name.endswith(".midi")
 
@@ -168,36 +272,38 @@ def convert_midi_to_state(
     scale = get_scale(scale_num, scale_type)
 
     if is_midi:
-        mt = load(f_name)
-
-        # convert to binary representation
-        mt.binarize()
-
-        # ensure that the vector is 0,1 only
-        track = mt.get_merged_pianoroll(mode="any").astype(int)
-
-        # NOTE: these are the dimensions
-        states = []
-        for s in track:
-            # compress to scale
-            states.append(s)
-        if twelve_tone_normalize:
-            states = squash_piano_roll_to_chromatic_frames(states)
-
-        if sc_num != None:
-            # Squash to scale
-            states = [squash_state_to_scale(s, CHROMATIC_SCALE[0:12]) for s in states]
-        states = list(filter(lambda x: np.sum(x) > 0, states))
-        deduped_states = []
-        for i, state in enumerate(states):
-            if i == 0:
-                deduped_states.append(state)
+        with stage("load_midi"):
+            from pypianoroll import load
+
+            mt = load(f_name)
+
+            if cell_states > 2:
+                # quantize velocities to states 1..cell_states - 1, 0 being silence
+                # widened, as uint8 velocities overflow when multiplied
+                velocities = mt.get_merged_pianoroll(mode="max").astype(np.int32)
+                states = np.ceil(velocities * (cell_states - 1) / 127).astype(np.uint8)
+                states = np.minimum(states, cell_states - 1)
             else:
-                # filter out silence
-                s = np.sum(state)
-                if s > 0 and not np.all(np.equal(state, states[i - 1])):
-                    deduped_states.append(state)
-        states = deduped_states
+                # convert to binary representation
+                mt.binarize()
+
+                # ensure that the vector is 0,1 only
+                states = mt.get_merged_pianoroll(mode="any").astype(np.uint8)
+
+            if twelve_tone_normalize:
+                states = squash_piano_roll_to_chromatic_frames(states)
+
+            if sc_num != None:
+                # Squash to scale
+                states = squash_state_to_scale(states.T, CHROMATIC_SCALE[0:12]).T
+
+            # filter out silence
+            states = states[np.any(states, axis=1)]
+
+            # filter out repeated frames
+            changed = np.ones((len(states),), dtype=bool)
+            changed[1:] = np.any(states[1:] != states[0:-1], axis=1)
+            states = states[changed]
     else:
         print("Not midi file: {}".format(f_name))
         exit(1)
@@ -209,6 +315,12 @@ def convert_midi_to_state(
     if save_json:
         write_states_to_file(states, f_name=json_states_file)
 
+    if save_binary:
+        bin_states_file = "{f_name}.{ext}".format(
+            f_name=(f_name + ".training_states"), ext=STATES_FILE_EXT
+        )
+        write_states_to_file(states, bin_states_file, {"source": f_name})
+
     return states
 
 
@@ -229,6 +341,43 @@ def get_scale(scale_num=None, scale_type="min", debug=False):
     return scale
 
 
+def simulate_states(
+    rule,
+    seed,
+    steps=DEFAULT_SEQUENCE_STEPS,
+    dont_ignore_odd=False,
+    detect_cycles=False,
+    sampler_name=None,
+    voices=sampling.DEFAULT_VOICES,
+    random_seed=None,
+):
+    """
+    Run a rule from a seed and apply the sampler, if any, to the resulting states
+    """
+    # THIS IS SUPER IMPORTANT TO GETTING GOOD RESULTS.  Unless dont_ignore_odd is set,
+    # the final bit is flipped to prevent [0,0,0] -> 1 transitions which clutter up CA
+    if detect_cycles:
+        # Stop simulating at the first repeated state and tile the cycle
+        states, cycle = run(
+            steps,
+            seed=seed,
+            rule=rule,
+            dont_ignore_odd=dont_ignore_odd,
+            detect_cycles=True,
+        )
+        print("transient: {}, period: {}".format(cycle["transient"], cycle["period"]))
+    else:
+        states = run(steps, seed=seed, rule=rule, dont_ignore_odd=dont_ignore_odd)
+
+    # apply a sampling filter to the states.
+    if sampler_name:
+        with stage("sample"):
+            sampler = getattr(sampling, sampler_name)
+            rng = np.random.default_rng(random_seed)
+            states = sampler(states, voices=voices, rng=rng)
+    return states
+
+
 def generate_states_from_rule_and_seed(
     f_name=None,
     rule=None,
@@ -242,11 +391,36 @@ def generate_states_from_rule_and_seed(
     save_png=False,
     save_json=False,
     save_midi=False,
+    save_binary=False,
     beat_duration=DEFAULT_BEAT_DURATION,
     dont_ignore_odd=False,
+    detect_cycles=False,
+    voices=sampling.DEFAULT_VOICES,
+    random_seed=None,
+    stream=False,
 ):
-    sc_num = scale_num
-    sc_type = scale_type
+    if stream:
+        if detect_cycles:
+            raise ValueError("Cycle detection needs every state, so can't stream")
+        return stream_states_from_rule_and_seed(
+            f_name,
+            rule,
+            seed,
+            scale_num,
+            scale_type,
+            steps,
+            sampler_name,
+            save_png=save_png,
+            save_json=save_json,
+            save_midi=save_midi,
+            save_binary=save_binary,
+            beat_duration=beat_duration,
+            dont_ignore_odd=dont_ignore_odd,
+            voices=voices,
+            random_seed=random_seed,
+        )
+
+    cell_states = rule_cell_states(rule)
 
     if len(seed):
         width = len(seed)
@@ -259,66 +433,179 @@ def generate_states_from_rule_and_seed(
         # Start from a default seed with 1 activated bit
         seed = DEFAULT_SEED
 
-    k = rule["k"]
-    a = np.array(rule["rule"])
-
-    # THIS IS SUPER IMPORTANT TO GETTING GOOD RESULTS.  It prevents [0,0,0] -> 1 transitions which clutter up CA
-    # Flip final bit
-    if not dont_ignore_odd:
-        a[-1] = 0
-
-    k_states = np.array(list(map(np.int64, rule["k_states"])))
-
-    # generate rule from k_states / mask
-    r_set = k_states[a.astype(bool)]
-
-    r = lambda x, k: eca(x, k, r_set)
-
-    states = run(steps, seed=seed, kernel=k, f=r)
-
-    # apply a sampling filter to the states.
-    if sampler_name:
-        sampler = getattr(sampling, sampler_name)
-        states = sampler(states)
+    states = simulate_states(
+        rule,
+        seed,
+        steps,
+        dont_ignore_odd=dont_ignore_odd,
+        detect_cycles=detect_cycles,
+        sampler_name=sampler_name,
+        voices=voices,
+        random_seed=random_seed,
+    )
 
     # TODO: add a conditional flag for image generation
     if save_png:
         f_name_img = f_name + ".tendril.png"
-        image_from_states(states, f_name_img)
+        with stage("write_png"):
+            image_from_states(states, f_name_img, cell_states=cell_states)
     if debug:
         print_states(states[0:10])
-    mets = metrics(states)
-
-    # g(states, steps, beat_duration)
-    if sc_num != None:
-        g = lambda x, y, z: generate_pianoroll(x, y, z, scale[0:width])
-    else:
-        g = lambda x, y, z: generate_pianoroll(x, y, z, CHROMATIC_SCALE[0:width])
+    with stage("metrics"):
+        mets = metrics(states)
 
-    if save_json or save_midi:
+    if save_json or save_midi or save_binary:
         write_files_from_states(
             states,
             mets,
             seed,
             [],
             f_name,
-            g=g,
+            scale=scale[0:width],
             save_json=save_json,
             save_midi=save_midi,
+            save_binary=save_binary,
             debug=debug,
             beat_duration=beat_duration,
+            cell_states=cell_states,
             steps=steps,
         )
     return
 
 
-def write_rule_to_json(rule, f_name, debug=False):
-    json_file = "{f_name}.{ext}".format(f_name=f_name + ".rule", ext="json")
+def staged_blocks(name, blocks):
+    """
+    Yield blocks, recording the time taken to produce each under the stage name
+    """
+    blocks = iter(blocks)
+    while True:
+        with stage(name):
+            block = next(blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+def stream_states_from_rule_and_seed(
+    f_name=None,
+    rule=None,
+    seed=[],
+    scale_num=None,
+    scale_type="maj",
+    steps=DEFAULT_SEQUENCE_STEPS,
+    sampler_name=None,
+    save_png=False,
+    save_json=False,
+    save_midi=False,
+    save_binary=False,
+    beat_duration=DEFAULT_BEAT_DURATION,
+    dont_ignore_odd=False,
+    voices=sampling.DEFAULT_VOICES,
+    random_seed=None,
+    block_size=DEFAULT_BLOCK_SIZE,
+):
+    """
+    Generate the same files as generate_states_from_rule_and_seed, simulating,
+    sampling and writing the states a block at a time
+
+    Memory stays constant and output starts with the first block, so steps may be
+    arbitrarily large, or None to generate until interrupted.  Returns the metrics.
+    """
+    cell_states = rule_cell_states(rule)
+    if len(seed):
+        width = len(seed)
+    else:
+        width = 128
+        seed = DEFAULT_SEED
+    scale = get_scale(scale_num, scale_type)[0:width]
+
+    blocks = run_stream(steps, seed, rule, dont_ignore_odd, block_size)
+    if sampler_name:
+        rng = np.random.default_rng(random_seed)
+        blocks = staged_blocks(
+            "sample", sampling.sample_blocks(blocks, sampler_name, voices, rng)
+        )
+
+    counter = StatesCounter()
+    # the image shows the first 64 states, and is saved as soon as they are in
+    image_rows = [] if save_png else None
+
+    def save_image():
+        with stage("write_png"):
+            f_name_img = f_name + ".tendril.png"
+            image_from_states(image_rows, f_name_img, cell_states=cell_states)
+
+    with ExitStack() as outputs:
+        track = None
+        if save_midi:
+            mid_file = "{f_name}.tendril.{ext}".format(f_name=f_name, ext="mid")
+            print("writing midi file to: ", mid_file)
+            writer = outputs.enter_context(MidiFileWriter(mid_file))
+            track = StatesTrack(writer, scale, beat_duration, cell_states=cell_states)
+            outputs.callback(track.close)
+
+        states_writer = None
+        if save_binary:
+            bin_file = "{f_name}.tendril_states.{ext}".format(
+                f_name=f_name, ext=STATES_FILE_EXT
+            )
+            print("writing tendril states to: {}".format(bin_file))
+            provenance = {"source": f_name, "steps": steps}
+            states_writer = outputs.enter_context(
+                StatesWriter(bin_file, len(seed), provenance, cell_states)
+            )
+        elif save_json or save_midi:
+            json_file = "{f_name}.tendril_states.{ext}".format(
+                f_name=f_name, ext="json"
+            )
+            print("writing tendril states to: {}".format(json_file))
+            states_writer = outputs.enter_context(JSONStatesWriter(json_file))
+
+        t = 0
+        try:
+            for block in blocks:
+                if track is not None:
+                    # the last state isn't played, as with whole sequences
+                    played = block if steps is None else block[0 : max(0, steps - t)]
+                    with stage("write_midi"):
+                        track.write(played)
+                if states_writer is not None:
+                    with stage("write_states"):
+                        states_writer.write(block)
+                with stage("metrics"):
+                    counter.update(block)
+                if image_rows is not None:
+                    image_rows.extend(block[0 : 64 - len(image_rows)])
+                    if len(image_rows) == 64:
+                        save_image()
+                        image_rows = None
+                t += len(block)
+        except KeyboardInterrupt:
+            # sequences without end stop here, with every output closed
+            if steps is not None:
+                raise
+            print("stopped after {} states".format(t))
+
+    if image_rows is not None:
+        save_image()
+    return counter.metrics()
+
+
+def serialize_rule(rule):
     d = {}
-    d["k"] = rule["k"]
+    d["k"] = np.asarray(rule["k"]).tolist()
     d["k_states"] = list(map(str, rule["k_states"]))
-    d["rule"] = rule["rule"]
+    d["rule"] = np.asarray(rule["rule"]).tolist()
     d["confidence_scores"] = rule["confidence_scores"]
+    if "encoding" in rule:
+        d["encoding"] = rule["encoding"]
+        d["kernel_radius"] = rule["kernel_radius"]
+    return d
+
+
+def write_rule_to_json(rule, f_name, debug=False):
+    json_file = "{f_name}.{ext}".format(f_name=f_name + ".rule", ext="json")
+    d = serialize_rule(rule)
     if debug:
         print("writing rule from dictionary: ")
         print(d)
@@ -328,27 +615,49 @@ def write_rule_to_json(rule, f_name, debug=False):
         json.dump(d, json_file)
 
 
-def learn_rule_from_file(
+def write_counts_to_file(learner, f_name):
+    with open(f_name, "w") as json_file:
+        json.dump(learner.to_dict(), json_file)
+
+    print("writing transition counts to: {}".format(f_name))
+
+
+def get_counts_from_file(f_name):
+    with open(f_name, "r") as json_file:
+        d = json.load(json_file)
+
+    return RuleLearner.from_dict(d)
+
+
+def read_training_states(
     f_name,
-    scale_num=None,
     scale_type="maj",
-    k_radius=1,
-    skip_write=False,
-    max_states=-1,
-    debug=False,
     save_json=False,
     save_midi=False,
+    save_binary=False,
+    cell_states=2,
 ):
+    """
+    Read the states to learn from in a JSON, binary states or MIDI file, returning
+    them with the number of cell states to learn
+    """
+    is_binary = is_states_file(f_name)
     is_midi = f_name.endswith(".mid") or f_name.endswith(".midi")
     is_json = f_name.endswith(".json")
 
-    sc_num = scale_num
-    sc_type = scale_type
-    scale = get_scale(scale_num, scale_type)
-
-    if is_midi:
+    if is_binary:
+        # memory-mapped, states are unpacked in blocks while learning
+        states = StatesFile(f_name)
+        cell_states = max(cell_states, states.cell_states)
+    elif is_midi:
         states = convert_midi_to_state(
-            f_name, None, scale_type, save_json=save_json, save_midi=save_midi,
+            f_name,
+            None,
+            scale_type,
+            save_json=save_json,
+            save_midi=save_midi,
+            save_binary=save_binary,
+            cell_states=cell_states,
         )
     elif is_json:
         # handle json
@@ -358,6 +667,69 @@ def learn_rule_from_file(
     else:
         print("File extension not supported!")
         exit(1)
+    return states, cell_states
+
+
+def get_learner(counts_file, k_radius=1, cell_states=2):
+    """
+    Return a learner continuing the counts in counts_file if it exists, or a new one
+    """
+    if counts_file and os.path.exists(counts_file):
+        # Add this file's transitions to the counts learned so far
+        learner = get_counts_from_file(counts_file)
+        if learner.kernel_radius != k_radius:
+            print(
+                "Counts in {} use kernel radius {}, not {}".format(
+                    counts_file, learner.kernel_radius, k_radius
+                )
+            )
+            exit(1)
+        if learner.cell_states != cell_states:
+            print(
+                "Counts in {} use {} cell states, not {}".format(
+                    counts_file, learner.cell_states, cell_states
+                )
+            )
+            exit(1)
+        return learner
+    return RuleLearner(k_radius, cell_states)
+
+
+def learn_states(learner, states):
+    """
+    Count the transitions of one sequence of states, in blocks for a StatesFile
+    """
+    if isinstance(states, StatesFile):
+        for block in states.blocks():
+            learner.update(block)
+    else:
+        learner.update(states)
+    return learner.end_sequence()
+
+
+def learn_rule_from_file(
+    f_name,
+    scale_num=None,
+    scale_type="maj",
+    k_radius=1,
+    skip_write=False,
+    max_states=-1,
+    debug=False,
+    save_json=False,
+    save_midi=False,
+    save_binary=False,
+    counts_file=None,
+    encoding=None,
+    cell_states=2,
+):
+    states, cell_states = read_training_states(
+        f_name,
+        scale_type,
+        save_json=save_json,
+        save_midi=save_midi,
+        save_binary=save_binary,
+        cell_states=cell_states,
+    )
 
     if debug:
         print_states(states[0:5])
@@ -366,7 +738,14 @@ def learn_rule_from_file(
     if max_states > -1:
         states = states[0:max_states]
 
-    rule = learn_rules_from_states(states, k_radius)
+    learner = get_learner(counts_file, k_radius, cell_states)
+
+    with stage("learn"):
+        learn_states(learner, states)
+
+        if counts_file:
+            write_counts_to_file(learner, counts_file)
+        rule = learner.finalize(encoding=encoding)
 
     write_rule_to_json(rule, f_name)
 
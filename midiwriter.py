@@ -0,0 +1,213 @@
+import struct
+import numpy as np
+
+DEFAULT_TEMPO = 120.0  # BPM, as in pypianoroll
+DEFAULT_RESOLUTION = 24  # ticks per beat, i.e. pypianoroll's beat resolution
+DEFAULT_VELOCITY = 100
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+PROGRAM_CHANGE = 0xC0
+DRUM_CHANNEL = 9
+
+
+def state_velocities(cell_states=2):
+    """
+    Return the MIDI velocity of each cell state, with state 0 silent and the highest
+    state at full velocity.  Binary cells play at DEFAULT_VELOCITY.
+    """
+    if cell_states == 2:
+        return np.array([0, DEFAULT_VELOCITY])
+    levels = np.arange(cell_states) / (cell_states - 1)
+    return np.round(levels * 127).astype(int)
+
+
+def encode_varlen(n):
+    """
+    Encode an integer as a MIDI variable-length quantity
+    """
+    buf = [n & 0x7F]
+    n >>= 7
+    while n:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    return bytes(reversed(buf))
+
+
+def encode_meta(meta_type, data):
+    return bytes([0xFF, meta_type]) + encode_varlen(len(data)) + data
+
+
+class MidiFileWriter:
+    """
+    Streams note events to a format 1 standard MIDI file, one track at a time.  Events
+    are flushed to the file in chunks of FLUSH_BYTES, and the length of each track is
+    filled in when it ends, so tracks of any length are written in constant memory.
+    """
+
+    FLUSH_BYTES = 1 << 16
+
+    def __init__(self, f_name, num_tracks=1, tempo=DEFAULT_TEMPO):
+        self.midi_file = open(f_name, "wb")
+        self.num_channels = 0
+        # Header chunk plus a tempo track
+        self.midi_file.write(
+            b"MThd" + struct.pack(">IHHH", 6, 1, num_tracks + 1, DEFAULT_RESOLUTION)
+        )
+        microseconds_per_beat = int(round(60000000 / tempo))
+        self.start_chunk()
+        self.write_event(0, encode_meta(0x51, microseconds_per_beat.to_bytes(3, "big")))
+        self.end_track()
+
+    def start_chunk(self):
+        self.chunk_start = self.midi_file.tell()
+        self.chunk_length = 0
+        # the length is filled in by end_track
+        self.midi_file.write(b"MTrk" + struct.pack(">I", 0))
+        self.events = bytearray()
+        self.tick = 0
+
+    def flush_events(self):
+        self.midi_file.write(self.events)
+        self.chunk_length += len(self.events)
+        self.events = bytearray()
+
+    def begin_track(self, name="", program=0, is_drum=False):
+        self.start_chunk()
+        if is_drum:
+            self.channel = DRUM_CHANNEL
+        else:
+            # Skip the drum channel, like pretty_midi
+            self.channel = self.num_channels + int(self.num_channels >= DRUM_CHANNEL)
+            self.num_channels += 1
+        self.write_event(0, encode_meta(0x03, name.encode("utf-8")))
+        self.write_event(0, bytes([PROGRAM_CHANGE | self.channel, program]))
+
+    def write_event(self, tick, data):
+        self.events += encode_varlen(tick - self.tick) + data
+        self.tick = tick
+        if len(self.events) >= self.FLUSH_BYTES:
+            self.flush_events()
+
+    def note_on(self, tick, pitch, velocity=DEFAULT_VELOCITY):
+        self.write_event(tick, bytes([NOTE_ON | self.channel, pitch, velocity]))
+
+    def note_off(self, tick, pitch):
+        self.write_event(tick, bytes([NOTE_OFF | self.channel, pitch, 0]))
+
+    def end_track(self):
+        self.write_event(self.tick, encode_meta(0x2F, b""))
+        self.flush_events()
+        end = self.midi_file.tell()
+        self.midi_file.seek(self.chunk_start + 4)
+        self.midi_file.write(struct.pack(">I", self.chunk_length))
+        self.midi_file.seek(end)
+        self.events = None
+
+    def close(self):
+        self.midi_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StatesTrack:
+    """
+    Writes states as the note events of one track, a block of states at a time
+
+    Each active cell i of state t plays scale[i] for one tick at tick t * beat_duration,
+    at the velocity of the cell's state.  With a beat duration of 1 the same pitch at
+    the same velocity in consecutive states is held as one note, matching the
+    pianoroll path.
+    """
+
+    def __init__(
+        self,
+        writer,
+        scale,
+        beat_duration,
+        name="tendril sequence",
+        program=0,
+        cell_states=2,
+        is_drum=False,
+    ):
+        self.writer = writer
+        self.scale = np.asarray(scale)
+        self.beat_duration = beat_duration
+        self.velocities = state_velocities(cell_states)
+        self.sounding = {}
+        self.t = 0
+        writer.begin_track(name, program, is_drum)
+
+    def write(self, states):
+        writer = self.writer
+        for state in states:
+            state = np.asarray(state)
+            active = np.nonzero(state)[0]
+            pitches = self.scale[active].tolist()
+            levels = self.velocities[state[active].astype(int)].tolist()
+            notes = {}
+            for pitch, velocity in zip(pitches, levels):
+                # note 0 is cleared in the pianoroll
+                if pitch > 0:
+                    notes[pitch] = max(velocity, notes.get(pitch, 0))
+            tick = self.t * self.beat_duration
+            sounding = self.sounding
+            if self.beat_duration == 1:
+                for pitch in sorted(p for p in sounding if notes.get(p) != sounding[p]):
+                    writer.note_off(tick, pitch)
+                for pitch in sorted(p for p in notes if sounding.get(p) != notes[p]):
+                    writer.note_on(tick, pitch, notes[pitch])
+                self.sounding = notes
+            else:
+                for pitch in sorted(notes):
+                    writer.note_on(tick, pitch, notes[pitch])
+                for pitch in sorted(notes):
+                    writer.note_off(tick + 1, pitch)
+            self.t += 1
+
+    def close(self):
+        for pitch in sorted(self.sounding):
+            self.writer.note_off(self.t * self.beat_duration, pitch)
+        self.writer.end_track()
+
+
+def write_states_track(
+    writer,
+    states,
+    scale,
+    steps,
+    beat_duration,
+    name="tendril sequence",
+    program=0,
+    cell_states=2,
+    is_drum=False,
+):
+    """
+    Write the first steps states of a sequence as one track of note events
+    """
+    track = StatesTrack(
+        writer, scale, beat_duration, name, program, cell_states, is_drum
+    )
+    track.write(states[t] for t in range(steps))
+    track.close()
+
+
+def write_midi_from_states(
+    f_name,
+    states,
+    scale,
+    steps,
+    beat_duration,
+    name="tendril sequence",
+    program=0,
+    tempo=DEFAULT_TEMPO,
+    cell_states=2,
+):
+    with MidiFileWriter(f_name, tempo=tempo) as writer:
+        write_states_track(
+            writer, states, scale, steps, beat_duration, name, program, cell_states
+        )
@@ -0,0 +1,177 @@
+import contextlib
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+
+NULL_STAGE = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    Records the wall time, peak memory and counters of named pipeline stages
+
+    Stages nest, and a stage entered more than once is reported once with its totals.
+    Times and memory of a stage include the stages nested in it.  Counters are added
+    to the innermost stage and to the totals.  When disabled, stages and counters cost
+    a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.stack = []
+        self.start_time = None
+        self.wall_time = None
+        self.peak_memory = 0
+        self.cprofile_stage = None
+        self.cprofile = None
+        self.tracing = False
+
+    def start(self, cprofile_stage=None):
+        """
+        Start recording, with a cProfile of every call of cprofile_stage if given
+        """
+        self.reset()
+        self.enabled = True
+        self.start_time = time.time()
+        self.cprofile_stage = cprofile_stage
+        if cprofile_stage:
+            import cProfile
+
+            self.cprofile = cProfile.Profile()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop(self):
+        self.wall_time = time.time() - self.start_time
+        self.peak_memory = self.traced_peak()
+        self.enabled = False
+        if self.tracing:
+            tracemalloc.stop()
+
+    def traced_peak(self):
+        """
+        Return the peak traced memory since start, across the resets of every stage
+        """
+        self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+        return self.peak_memory
+
+    def stage_stats(self, name):
+        return self.stages.setdefault(
+            name, {"calls": 0, "seconds": 0.0, "peak_memory": 0, "counters": {}}
+        )
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return self.record_stage(name)
+
+    @contextlib.contextmanager
+    def record_stage(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        # the peak is reset for every stage, so fold it into the enclosing ones first
+        self.traced_peak()
+        for frame in self.stack:
+            frame["peak"] = max(frame["peak"], peak)
+        # before Python 3.9 the peak can't be reset, and includes earlier stages
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        frame = {"name": name, "start_memory": current, "peak": current}
+        self.stack.append(frame)
+
+        profile = self.cprofile if name == self.cprofile_stage else None
+        if profile is not None:
+            profile.enable()
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            if profile is not None:
+                profile.disable()
+            self.stack.pop()
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            for outer in self.stack:
+                outer["peak"] = max(outer["peak"], peak)
+
+            stats = self.stage_stats(name)
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["peak_memory"] = max(
+                stats["peak_memory"], peak - frame["start_memory"]
+            )
+
+    def count(self, name, n=1):
+        """
+        Add n to a counter of the current stage
+        """
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.stack:
+            counters = self.stage_stats(self.stack[-1]["name"])["counters"]
+            counters[name] = counters.get(name, 0) + n
+
+    def report(self):
+        if self.enabled:
+            wall_time = time.time() - self.start_time
+            peak_memory = self.traced_peak()
+        else:
+            wall_time = self.wall_time
+            peak_memory = self.peak_memory
+        return {
+            "wall_time": wall_time,
+            "peak_memory": peak_memory,
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+
+    def write_report(self, f_name):
+        """
+        Write the report as JSON, and the cProfile of the profiled stage, if any, as
+        f_name with the stage name and .prof appended
+        """
+        with open(f_name, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        print("writing profile to: {}".format(f_name))
+
+        if self.cprofile is not None:
+            prof_file = "{}.{}.prof".format(f_name, self.cprofile_stage)
+            self.cprofile.dump_stats(prof_file)
+            print("writing {} cProfile to: {}".format(self.cprofile_stage, prof_file))
+
+
+PROFILER = Profiler()
+
+
+def stage(name):
+    """
+    Record a pipeline stage, as in `with stage("simulate"): ...`
+    """
+    return PROFILER.stage(name)
+
+
+def count(name, n=1):
+    PROFILER.count(name, n)
+
+
+@contextlib.contextmanager
+def profile(f_name=None, cprofile_stage=None):
+    """
+    Profile the stages run in the block, writing the report to f_name if given
+
+    Yields the profiler, whose report() is available in and after the block.
+    """
+    PROFILER.start(cprofile_stage)
+    try:
+        yield PROFILER
+    finally:
+        PROFILER.stop()
+        if f_name:
+            PROFILER.write_report(f_name)
@@ -0,0 +1,147 @@
+import json
+import os
+import struct
+import numpy as np
+
+from ca import generate_k_states_from_k_radius, generate_rule_from_k_states, tens
+
+RULE_BANK_MAGIC = b"TNDRLRB1"
+RULE_REF_SEPARATOR = "#"
+
+
+def iter_rules_for_k(k_radius, start=0, stop=None):
+    """
+    Lazily enumerate the rules of a kernel radius from rule number start to stop
+    """
+    k_len = (k_radius * 2) + 1
+    if stop is None:
+        stop = 2 ** (2 ** k_len)
+
+    k_states = generate_k_states_from_k_radius(k_radius)
+    r = start
+    while r < stop:
+        yield generate_rule_from_k_states(k_states, k_radius, r)
+        r += 1
+
+
+def write_rule_bank(f_name, k_radius, rules, debug=False, start=0):
+    """
+    Write rules sharing a kernel radius to a rule bank: one header followed by the
+    bit-packed rule of every entry, in order, the first being rule number start
+    """
+    k_len = (k_radius * 2) + 1
+    rule_bytes = ((2 ** k_len) + 7) // 8
+    header = {
+        "k": tens(k_len),
+        "k_states": list(map(str, generate_k_states_from_k_radius(k_radius))),
+        "kernel_radius": k_radius,
+        "rule_bytes": rule_bytes,
+        "start": start,
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    num_rules = 0
+    with open(f_name, "wb") as bank_file:
+        bank_file.write(RULE_BANK_MAGIC)
+        bank_file.write(struct.pack("<I", len(header_bytes)))
+        bank_file.write(header_bytes)
+        for rule in rules:
+            packed = np.packbits(np.array(rule["rule"], dtype=bool))
+            bank_file.write(packed.tobytes().ljust(rule_bytes, b"\0"))
+            num_rules += 1
+
+    if debug:
+        print(header)
+    print("writing {} rules to bank: {}".format(num_rules, f_name))
+    return num_rules
+
+
+def is_rule_bank(f_name):
+    try:
+        with open(f_name, "rb") as bank_file:
+            return bank_file.read(len(RULE_BANK_MAGIC)) == RULE_BANK_MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def split_rule_ref(ref):
+    """
+    Split a "bank.bin#1234" style reference into the bank path and rule number
+    """
+    if RULE_REF_SEPARATOR not in ref:
+        return ref, None
+    f_name, idx = ref.rsplit(RULE_REF_SEPARATOR, 1)
+    return f_name, int(idx)
+
+
+class RuleBank:
+    """
+    Memory-mapped rule bank, indexable by rule number without reading other rules
+    """
+
+    def __init__(self, f_name):
+        with open(f_name, "rb") as bank_file:
+            magic = bank_file.read(len(RULE_BANK_MAGIC))
+            if magic != RULE_BANK_MAGIC:
+                raise ValueError("Not a rule bank: {}".format(f_name))
+            (header_len,) = struct.unpack("<I", bank_file.read(4))
+            self.header = json.loads(bank_file.read(header_len).decode("utf-8"))
+
+        offset = len(RULE_BANK_MAGIC) + 4 + header_len
+        self.kernel_radius = self.header["kernel_radius"]
+        self.k = np.array(self.header["k"])
+        self.k_states = np.array(list(map(int, self.header["k_states"])))
+        self.rule_len = len(self.k_states)
+        # rule number of the first entry, as banks can hold a range of rules
+        self.start = self.header.get("start", 0)
+
+        rule_bytes = self.header["rule_bytes"]
+        if os.path.getsize(f_name) > offset:
+            masks = np.memmap(f_name, dtype=np.uint8, mode="r", offset=offset)
+            self.masks = masks.reshape(-1, rule_bytes)
+        else:
+            self.masks = np.zeros((0, rule_bytes), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.masks)
+
+    @property
+    def stop(self):
+        return self.start + len(self)
+
+    def __getitem__(self, r):
+        if not self.start <= r < self.stop:
+            raise IndexError(
+                "Rule {} is not in the bank of rules {} to {}".format(
+                    r, self.start, self.stop
+                )
+            )
+        rule = np.unpackbits(self.masks[r - self.start])[0 : self.rule_len].astype(int)
+        return {
+            "k": self.k,
+            "rule": rule,
+            "k_states": self.k_states,
+            "confidence_scores": {},
+        }
+
+    def __iter__(self):
+        return self.rules()
+
+    def rules(self, start=None, stop=None):
+        """
+        Lazily iterate over the rules numbered start to stop, by default all of them
+        """
+        if start is None:
+            start = self.start
+        if stop is None:
+            stop = self.stop
+        for r in range(start, stop):
+            yield self[r]
+
+
+def get_rule_from_bank(ref):
+    f_name, r = split_rule_ref(ref)
+    bank = RuleBank(f_name)
+    if r is None:
+        r = bank.start
+    return bank[r]
@@ -1,51 +1,109 @@
 import numpy as np
 
+DEFAULT_VOICES = 2
 
-def noop(states):
+
+def noop(states, voices=DEFAULT_VOICES, rng=None):
     return states
 
 
-def random_walk_sampler(states):
+def nearest_live_cells(states):
     """
-    Use random-walk strategy for sampling bits from the state space
+    For every cell, find the index of the nearest live cell strictly to its right and
+    strictly to its left in the same state, or -1 when there is none.
+
+    Returns a (2, height, width) array of the right and left indices.
     """
+    live = np.asarray(states).astype(bool)
+    height, width = live.shape
+    # the smallest signed type holding -1 and width keeps the running scans cheap
+    dtype = np.min_scalar_type(-width - 1)
+    cols = np.arange(width, dtype=dtype)
 
-    height = len(states)
-    width = len(states[0])
-    voices = 2
+    nearest = np.full((2, height, width), -1, dtype=dtype)
+    # nearest live cell at or right of j, from a running minimum over reversed states
+    at_or_right = np.where(live, cols, dtype.type(width))[:, ::-1]
+    at_or_right = np.minimum.accumulate(at_or_right, axis=1)[:, ::-1]
+    nearest[0, :, :-1] = at_or_right[:, 1:]
+    nearest[0][nearest[0] == width] = -1
+    # nearest live cell at or left of j, from a running maximum
+    at_or_left = np.maximum.accumulate(np.where(live, cols, dtype.type(-1)), axis=1)
+    nearest[1, :, 1:] = at_or_left[:, :-1]
+    return nearest
+
+
+def random_walk(states, cursors, rng):
+    """
+    Walk one voice from each cell index in cursors over the states, updating cursors
+    to where the voices end
+    """
+    states = np.asarray(states)
+    height, width = states.shape
+    voices = len(cursors)
 
-    # generate empty states array
-    result = [np.zeros((width,)) for i in range(0, height)]
+    nearest = nearest_live_cells(states).ravel()
+    # offset into nearest of the (direction, state) row of every step of every voice
+    directions = (rng.random((height, voices)) > 0.5).astype(np.intp)
+    offsets = (directions * height + np.arange(height)[:, np.newaxis]) * width
 
     ## Strategy 1:  Follow a 1-bit path, once per "voice"
-    for v in range(0, voices):
-        cursor = 0
-        for i in range(0, height):
-            ith_state = states[i]
-            # print("ith_state", ith_state, cursor)
-            s = result[i]
-            bit = 0
-            j = cursor
-            if np.random.rand() > 0.5:
-                step = -1
-            else:
-                step = 1
-            # move once in randomly selected direction
-            j += step
-            # find location of first on bit
-            while j in range(0, width):
-                if ith_state[j]:
-                    cursor = j
-                    bit = 1
-                    break
-                j += step
-            if not bit:
-                continue
-                # print("No bit set!")
-            else:
-                s[cursor] = bit
+    result = np.zeros(states.shape, dtype=states.dtype)
+    rows = np.arange(height)
+    for v in range(voices):
+        # each step is a single lookup, so walk with plain ints
+        path = []
+        cursor = cursors[v]
+        for offset in offsets[:, v].tolist():
+            j = int(nearest[offset + cursor])
+            path.append(j)
+            if j >= 0:
+                cursor = j
+        path = np.array(path, dtype=np.intp)
+        active = path >= 0
+        # keep the state of the sampled cells
+        result[rows[active], path[active]] = states[rows[active], path[active]]
+        cursors[v] = cursor
     return result
 
 
-__all__ = ["noop", "random_walk_sampler"]
+def random_walk_sampler(states, voices=DEFAULT_VOICES, rng=None):
+    """
+    Use random-walk strategy for sampling bits from the state space
+
+    Each voice starts at cell 0 and, at every state, moves left or right at random to
+    the nearest live cell in that direction.  The voice stays put and plays nothing
+    when there is no live cell that way.  Pass a numpy Generator as rng for
+    reproducible walks.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    return random_walk(states, [0] * voices, rng)
 
+
+def random_walk_sampler_blocks(blocks, voices=DEFAULT_VOICES, rng=None):
+    """
+    random_walk_sampler over consecutive blocks of states, continuing every walk from
+    one block into the next.  Yields the same states as sampling all of them at once.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    cursors = [0] * voices
+    for block in blocks:
+        yield random_walk(block, cursors, rng)
+
+
+def sample_blocks(blocks, sampler_name, voices=DEFAULT_VOICES, rng=None):
+    """
+    Apply a sampler to consecutive blocks of states, lazily
+
+    Samplers with a <name>_blocks variant carry their state across blocks, and other
+    samplers sample each block on its own.
+    """
+    streaming = globals().get(sampler_name + "_blocks")
+    if streaming is not None:
+        return streaming(blocks, voices=voices, rng=rng)
+    sampler = globals()[sampler_name]
+    return (sampler(block, voices=voices, rng=rng) for block in blocks)
+
+
+__all__ = ["noop", "random_walk_sampler"]
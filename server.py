@@ -0,0 +1,223 @@
+import base64
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import traceback
+from collections import OrderedDict
+import numpy as np
+
+import sampling
+from ca import DEFAULT_SEED, DEFAULT_SEQUENCE_STEPS, rule_cell_states, run
+from midi import choose_seed, get_rule_from_file, get_seeds_from_file, serialize_rule
+from rulebank import split_rule_ref
+
+DEFAULT_SOCKET = "/tmp/tendril.sock"
+FILE_CACHE_SIZE = 128
+
+
+class FileCache:
+    """
+    Bounded LRU cache of values loaded from files, reloaded when a file's
+    modification time changes
+    """
+
+    def __init__(self, load, max_size=FILE_CACHE_SIZE):
+        self.load = load
+        self.max_size = max_size
+        # (mtime, value) by absolute path
+        self.values = OrderedDict()
+
+    def get(self, f_name):
+        # bank.bin#1234 is cached per entry but checked against bank.bin
+        mtime = os.path.getmtime(os.path.abspath(split_rule_ref(f_name)[0]))
+        key = os.path.abspath(f_name)
+        if key in self.values and self.values[key][0] == mtime:
+            self.values.move_to_end(key)
+            return self.values[key][1]
+
+        # a rewritten file replaces the value loaded before it
+        self.values[key] = (mtime, self.load(f_name))
+        self.values.move_to_end(key)
+        if len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+        return self.values[key][1]
+
+
+class TendrilServer(socketserver.UnixStreamServer):
+    """
+    Serves JSON requests, one per line, from a warm process with rules and seeds cached
+
+    {"argv": [...]} runs a CLI command, and {"command": "generate", ...} or
+    {"command": "learn", ...} return states or a rule inline.  Requests may carry
+    a "cwd" that relative paths are resolved against, for that request only.
+    """
+
+    def __init__(self, socket_path):
+        self.rules = FileCache(get_rule_from_file)
+        self.seeds = FileCache(get_seeds_from_file)
+        super().__init__(socket_path, TendrilRequestHandler)
+
+    def get_rule(self, f_name):
+        return self.rules.get(f_name)
+
+    def get_seed(self, f_name):
+        return choose_seed(self.seeds.get(f_name))
+
+    def handle_request_dict(self, request):
+        if "cwd" not in request:
+            return self.run_request(request)
+        # requests are handled one at a time, so the directory can be switched
+        cwd = os.getcwd()
+        os.chdir(request["cwd"])
+        try:
+            return self.run_request(request)
+        finally:
+            os.chdir(cwd)
+
+    def run_request(self, request):
+        if "argv" in request:
+            return self.run_argv(request["argv"])
+
+        command = request.get("command")
+        if command == "generate":
+            return self.generate(request)
+        if command == "learn":
+            return self.learn(request)
+        return {"status": 1, "error": "Unknown command: {}".format(command)}
+
+    def run_argv(self, argv):
+        from main import build_parser, execute
+
+        output = io.StringIO()
+        status = 0
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                args = build_parser().parse_args(argv)
+                execute(args, get_rule=self.get_rule, get_seed=self.get_seed)
+            except SystemExit as e:
+                # exit() with no code is a success
+                status = e.code if isinstance(e.code, int) else int(bool(e.code))
+        return {"status": status, "output": output.getvalue()}
+
+    def generate(self, request):
+        """
+        Generate states from a rule and seed, returned base64 encoded, bit-packed or,
+        for cells with more than 2 states, one byte per cell
+        """
+        rule = self.get_rule(request["rule"])
+        if request.get("seed"):
+            seed = self.get_seed(request["seed"])
+        else:
+            seed = DEFAULT_SEED
+
+        states = run(
+            request.get("steps", DEFAULT_SEQUENCE_STEPS),
+            seed=seed,
+            rule=rule,
+            dont_ignore_odd=request.get("dont_ignore_odd", False),
+        )
+        if request.get("sampler"):
+            sampler = getattr(sampling, request["sampler"])
+            rng = np.random.default_rng(request.get("random_seed"))
+            states = sampler(
+                states, voices=request.get("voices", sampling.DEFAULT_VOICES), rng=rng
+            )
+
+        states = np.asarray(states)
+        cell_states = rule_cell_states(rule)
+        if cell_states > 2:
+            packed = states.astype(np.uint8)
+        else:
+            packed = np.packbits(states.astype(bool), axis=1)
+        return {
+            "status": 0,
+            "width": states.shape[1],
+            "steps": states.shape[0],
+            "cell_states": cell_states,
+            "states": base64.b64encode(packed.tobytes()).decode("ascii"),
+        }
+
+    def learn(self, request):
+        """
+        Learn a rule from a states, MIDI or binary states file and return it inline
+        """
+        from midi import learn_rule_from_file
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            rule, _ = learn_rule_from_file(
+                request["path"],
+                k_radius=request.get("kernel_radius", 1),
+                encoding=request.get("encoding"),
+                cell_states=request.get("cell_states", 2),
+                save_json=request.get("save_json", False),
+            )
+        return {"status": 0, "output": output.getvalue(), "rule": serialize_rule(rule)}
+
+
+class TendrilRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.handle_request_dict(json.loads(line))
+            except Exception as e:
+                response = {
+                    "status": 1,
+                    "error": "{}: {}".format(type(e).__name__, e),
+                    "output": traceback.format_exc(),
+                }
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def serve(socket_path=DEFAULT_SOCKET):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = TendrilServer(socket_path)
+    print("serving on: {}".format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def request(socket_path, request_dict):
+    """
+    Send one request to a running server and return its response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request_dict).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as response_file:
+            return json.loads(response_file.readline())
+
+
+def forward(socket_path, argv):
+    """
+    Forward CLI arguments, minus --connect, to a running server and print its output
+
+    Returns the exit status of the command.
+    """
+    forwarded = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--connect":
+            skip = True
+        elif not arg.startswith("--connect="):
+            forwarded.append(arg)
+
+    response = request(socket_path, {"argv": forwarded, "cwd": os.getcwd()})
+    print(response.get("output", ""), end="")
+    if "error" in response:
+        print(response["error"])
+    return response["status"]
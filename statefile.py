@@ -0,0 +1,154 @@
+import json
+import os
+import struct
+import numpy as np
+
+STATES_FILE_MAGIC = b"TNDRLST1"
+STATES_FILE_EXT = "bin"
+HEADER_PADDING = 64  # room for the header to grow when it is rewritten on close
+
+
+def is_states_file(f_name):
+    try:
+        with open(f_name, "rb") as states_file:
+            return states_file.read(len(STATES_FILE_MAGIC)) == STATES_FILE_MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def row_bytes(width, cell_states=2):
+    # binary cells are bit-packed, other cells take a byte each
+    if cell_states == 2:
+        return (width + 7) // 8
+    return width
+
+
+class StatesWriter:
+    """
+    Appends bit-packed states to a binary states file, so states can be written in
+    blocks without holding all of them in memory
+
+    States of cells with more than 2 states are stored as one byte per cell.
+    """
+
+    def __init__(self, f_name, width, provenance=None, cell_states=2):
+        self.f_name = f_name
+        self.width = width
+        self.cell_states = cell_states
+        self.steps = 0
+        self.provenance = provenance or {}
+        self.states_file = open(f_name, "wb")
+        self.header_len = len(self._header()) + HEADER_PADDING
+        self._write_header()
+
+    def _header(self):
+        header = {
+            "width": self.width,
+            "steps": self.steps,
+            "row_bytes": row_bytes(self.width, self.cell_states),
+            "cell_states": self.cell_states,
+            "provenance": self.provenance,
+        }
+        return json.dumps(header).encode("utf-8")
+
+    def _write_header(self):
+        self.states_file.seek(0)
+        self.states_file.write(STATES_FILE_MAGIC)
+        self.states_file.write(struct.pack("<I", self.header_len))
+        self.states_file.write(self._header().ljust(self.header_len, b" "))
+
+    def write(self, states):
+        states = np.atleast_2d(np.asarray(states))
+        if states.shape[1] != self.width:
+            raise ValueError(
+                "Expected states of width {}, got {}".format(
+                    self.width, states.shape[1]
+                )
+            )
+        if self.cell_states == 2:
+            rows = np.packbits(states.astype(bool), axis=1)
+        else:
+            rows = states.astype(np.uint8)
+        self.states_file.write(rows.tobytes())
+        self.steps += len(states)
+
+    def close(self):
+        # Record the final number of steps
+        self._write_header()
+        self.states_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_states_file(states, f_name, provenance=None, cell_states=None):
+    """
+    Write states to a binary states file, inferring the number of cell states from
+    the states unless given
+    """
+    states = np.atleast_2d(np.asarray(states))
+    if cell_states is None:
+        cell_states = max(2, int(states.max()) + 1 if states.size else 2)
+    with StatesWriter(f_name, states.shape[1], provenance, cell_states) as writer:
+        writer.write(states)
+
+
+class StatesFile:
+    """
+    Memory-mapped binary states file.  Indexing unpacks only the requested states.
+    """
+
+    def __init__(self, f_name):
+        with open(f_name, "rb") as states_file:
+            magic = states_file.read(len(STATES_FILE_MAGIC))
+            if magic != STATES_FILE_MAGIC:
+                raise ValueError("Not a binary states file: {}".format(f_name))
+            (header_len,) = struct.unpack("<I", states_file.read(4))
+            self.header = json.loads(states_file.read(header_len).decode("utf-8"))
+
+        offset = len(STATES_FILE_MAGIC) + 4 + header_len
+        self.width = self.header["width"]
+        self.provenance = self.header["provenance"]
+        self.cell_states = self.header.get("cell_states", 2)
+
+        row_bytes = self.header["row_bytes"]
+        if os.path.getsize(f_name) > offset:
+            rows = np.memmap(f_name, dtype=np.uint8, mode="r", offset=offset)
+            self.rows = rows.reshape(-1, row_bytes)
+        else:
+            self.rows = np.zeros((0, row_bytes), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if self.cell_states != 2:
+            return np.array(self.rows[idx])
+        return np.unpackbits(self.rows[idx], axis=-1)[..., 0 : self.width]
+
+    def __iter__(self):
+        for block in self.blocks():
+            for state in block:
+                yield state
+
+    def blocks(self, block_size=4096):
+        """
+        Iterate over the states in (block_size, width) arrays
+        """
+        for start in range(0, len(self), block_size):
+            yield self[start : start + block_size]
+
+
+def read_states(f_name):
+    """
+    Read states from a binary states file or a JSON file with a "states" list
+    """
+    if is_states_file(f_name):
+        return StatesFile(f_name)
+
+    with open(f_name, "r") as json_file:
+        d = json.load(json_file)
+    return d["states"]
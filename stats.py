@@ -1,41 +1,90 @@
-from bits import encode_state
-from scipy.stats import entropy
+from collections import OrderedDict
 
+import numpy as np
 
-def metrics(results_arr):
-    # size = len(results_arr)
-    states_set = set()
-    states_counts = {}
-    states_distribution = {}
-    for s in results_arr:
-        s_t = encode_state(s)  # create tuple
-        s_hash = str(s_t)
-        states_set.add(s_t)
-        if s_t in states_counts:
-            states_counts[s_hash] = states_counts[s_hash] + 1
+
+def entropy(pk, base, counts=None):
+    """
+    Shannon entropy of the normalized pk, as computed by scipy.stats.entropy, without
+    the cost of importing scipy.stats
+
+    counts repeats each pk[i] counts[i] times, without building the repeated array.
+    A base of 1 or less, i.e. a single state, has no uncertainty and returns 0.
+    """
+    if base <= 1:
+        return 0.0
+    if counts is None:
+        counts = 1
+    pk = pk / np.sum(counts * pk)
+    return -np.sum(counts * pk * np.log(pk)) / np.log(base)
+
+
+class StatesCounter:
+    """
+    Counts the distinct states of a sequence, a block of states at a time, so metrics
+    of sequences too long to hold in memory can be computed as they are generated.
+    Memory grows with the number of distinct states, not the length of the sequence.
+    """
+
+    def __init__(self):
+        # count of each state's bytes, in order of appearance
+        self.counts = OrderedDict()
+        self.size = 0
+        # binary states are counted packed, until a state with more than 2 values
+        self.by_value = False
+        self.width = None
+
+    def update(self, states):
+        states = np.asarray(states)
+        if not states.size:
+            return self
+        if not self.by_value and states.max() > 1:
+            self.by_value = True
+            unpacked = OrderedDict()
+            for key, c in self.counts.items():
+                packed = np.frombuffer(key, dtype=np.uint8)
+                unpacked[np.unpackbits(packed)[0 : self.width].tobytes()] = c
+            self.counts = unpacked
+        self.width = states.shape[1]
+
+        if self.by_value:
+            # cells with more than 2 states are counted by value
+            packed = states.astype(np.uint8)
         else:
-            states_counts[s_hash] = 1
-
-    # Num states
-    num_states = len(states_set)
-    for key in states_counts:
-        states_distribution[key] = states_counts[key] / num_states
-
-    # Calculate entropy
-    probs_of_state = []
-
-    for s in results_arr:
-        s_t = encode_state(s)  # create tuple
-        s_hash = str(s_t)
-        prob_of_state = states_distribution[s_hash]
-        probs_of_state.append(prob_of_state)
-
-    # print("Probs", probs_of_state)
-    ent_score = entropy(probs_of_state, base=num_states)
-
-    return {
-        "states_counts": states_counts,
-        "states_distribution": states_distribution,
-        "entropy_score": ent_score,
-        "num_states": num_states,
-    }
+            # Pack every state once and count the distinct ones
+            packed = np.packbits(states.astype(bool), axis=1)
+        unique_states, first_seen, counts = np.unique(
+            packed, axis=0, return_index=True, return_counts=True
+        )
+        for i in np.argsort(first_seen):
+            key = unique_states[i].tobytes()
+            self.counts[key] = self.counts.get(key, 0) + int(counts[i])
+        self.size += len(states)
+        return self
+
+    def metrics(self):
+        states_counts = {}
+        states_distribution = {}
+        for key, c in self.counts.items():
+            # iterating bytes gives their values, as in tuple(state.tolist())
+            s_hash = str(tuple(key))
+            states_counts[s_hash] = c
+            states_distribution[s_hash] = c / self.size
+
+        # Num states
+        num_states = len(self.counts)
+
+        # Calculate entropy of the probability of every state in the sequence
+        counts = np.array(list(self.counts.values()))
+        ent_score = entropy(counts / self.size, base=num_states, counts=counts)
+
+        return {
+            "states_counts": states_counts,
+            "states_distribution": states_distribution,
+            "entropy_score": ent_score,
+            "num_states": num_states,
+        }
+
+
+def metrics(results_arr):
+    return StatesCounter().update(results_arr).metrics()
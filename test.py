@@ -1,16 +1,23 @@
+import argparse
 import glob
 import json
+import os
+import random
 import re
+import time
+from multiprocessing import Pool
+
+import numpy as np
 from bitarray import bitarray, util
 
 TEST_BASE = "./test_data"
 TEST_DIR = "{}/eca_8bit".format(TEST_BASE)
-TENDRIL_SUFFIX = ".tendril_states.json"
+TENDRIL_SUFFIXES = [".tendril_states.json", ".tendril_states.bin"]
 RULE_SUFFIX = ".rule.json"
-TEST_RULE_GLOB = "{}/r_*{}.rule.json".format(TEST_DIR, TENDRIL_SUFFIX)
-STATES_FILE_GLOB = "{}/r_*.rule.json{}".format(TEST_DIR, TENDRIL_SUFFIX)
-files = glob.glob(TEST_RULE_GLOB)
-states_files = glob.glob(STATES_FILE_GLOB)
+STATES_FILE_GLOB = "{}/r_*.rule.json{}"
+DEFAULT_TEST_SEED = "examples/seeds/seed_32x1_1bit_active.json"
+DEFAULT_TEST_STEPS = 32
+MAX_EXHAUSTIVE_RULES = 2 ** 16
 
 
 def parse_file(f_name):
@@ -53,56 +60,284 @@ def check_result(result, states_dict, check_ambiguous=True):
                 return False
 
 
-# Get all states by rule:
-
-states_by_rule_int = {}
-
-for f in states_files:
-    d = parse_file(f)
-    m = re.findall(r"r_\d+", f)
-    if m:
-        n = int(m[0].split("_")[1])
-    # print(f)
-    states_by_rule_int[n] = d["states"]
-
-results = {}
-
-for f in files:
-    f1 = f.replace(TENDRIL_SUFFIX + RULE_SUFFIX, "")  # actual
-    f2 = f  # generated file
-    d1 = parse_file(f1)
-    d2 = parse_file(f2)
-    r1 = d1["rule"]
-    r2 = d2["rule"]
-    r1i = rule_to_int(r1)
-    r2i = rule_to_int(r2)
-    results[f1] = {
-        "expected": r1i,
-        "actual": r2i,
-        "expected_bits": r1,
-        "actual_bits": r2,
-        "data": d1,
-        "data": d2,
+def score_results(results, states_by_rule_int):
+    """
+    Return the share of matched rules and the share of rules not matched exactly
+    """
+    total = len(results.keys())
+    matched = 0
+    ambiguous_patterns = 0
+
+    # count matches
+    for k in results:
+        result = results[k]
+        if check_result(result, states_by_rule_int):
+            matched += 1
+
+    # count ambiguous patterns:
+    for k in results:
+        result = results[k]
+        if not check_result(result, states_by_rule_int, check_ambiguous=False):
+            ambiguous_patterns += 1
+
+    return matched / total, ambiguous_patterns / total
+
+
+def score_test_dir():
+    """
+    Score the rule and states files written to TEST_DIR by the CLI
+    """
+    from statefile import read_states
+
+    states_files = []
+    for suffix in TENDRIL_SUFFIXES:
+        states_files += [
+            (f, suffix) for f in glob.glob(STATES_FILE_GLOB.format(TEST_DIR, suffix))
+        ]
+
+    # Get all states by rule:
+    states_by_rule_int = {}
+
+    for f, _ in states_files:
+        states = read_states(f)
+        m = re.findall(r"r_\d+", f)
+        if m:
+            n = int(m[0].split("_")[1])
+        states_by_rule_int[n] = np.asarray(states[0 : len(states)]).tolist()
+
+    results = {}
+
+    for f, suffix in states_files:
+        f1 = f.replace(suffix, "")  # actual
+        f2 = f + RULE_SUFFIX  # generated file
+        d1 = parse_file(f1)
+        d2 = parse_file(f2)
+        r1 = d1["rule"]
+        r2 = d2["rule"]
+        r1i = rule_to_int(r1)
+        r2i = rule_to_int(r2)
+        results[f1] = {
+            "expected": r1i,
+            "actual": r2i,
+            "expected_bits": r1,
+            "actual_bits": r2,
+            "data": d1,
+            "data": d2,
+        }
+
+    write_results(results)
+
+    return score_results(results, states_by_rule_int)
+
+
+def test_multi_state_midi_conversion(cell_states=8):
+    """
+    Write every cell state as MIDI velocities and convert them back, checking the
+    loudest notes come back as the highest state
+    """
+    import tempfile
+
+    from midi import convert_midi_to_state
+    from midiwriter import write_midi_from_states
+    from scales import CHROMATIC_SCALE
+
+    # one state per note, shifted every step so each note plays every state
+    width = 24
+    steps = 32
+    states = (np.arange(steps)[:, None] + np.arange(width)) % cell_states
+    scale = np.asarray(CHROMATIC_SCALE[0:width])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        f_name = os.path.join(tmp_dir, "states.mid")
+        write_midi_from_states(f_name, states, scale, steps, 8, cell_states=cell_states)
+        converted = convert_midi_to_state(f_name, cell_states=cell_states)
+
+    # state cell_states - 1 plays at velocity 127, which must not overflow
+    assert converted.max() == cell_states - 1
+
+
+def recover_rules(args):
+    """
+    Generate states from each rule, learn a rule back from them and compare
+
+    Returns (expected, actual, ambiguous, matched) per rule, where ambiguous is True
+    when the rules differ and matched is True when the actual rule generates the same
+    states as the expected one.
+    """
+    k_radius, rule_numbers, seed, steps = args
+
+    from ca import (
+        TENS_ENCODING,
+        generate_k_states_from_k_radius,
+        generate_rule_from_k_states,
+        learn_rules_from_states,
+        run,
+        run_batch,
+    )
+
+    k_states = generate_k_states_from_k_radius(k_radius)
+    rules = [generate_rule_from_k_states(k_states, k_radius, r) for r in rule_numbers]
+    batch = run_batch(rules, seed, steps, dont_ignore_odd=True)
+
+    recovered = []
+    for r, states in zip(rule_numbers, batch):
+        # dense tens() rules list every neighborhood in the order of the generated
+        # ones, so their numbers compare even beyond MAX_TENS_RADIUS
+        learned = learn_rules_from_states(states, k_radius, encoding=TENS_ENCODING)
+        actual = rule_to_int(learned["rule"])
+        ambiguous = actual != r
+        if ambiguous:
+            # regenerate the states of the learned rule from the same seed
+            actual_states = run(steps, seed=seed, rule=learned, dont_ignore_odd=True)
+            matched = np.array_equal(states, np.array(actual_states))
+        else:
+            matched = True
+        recovered.append((int(r), actual, ambiguous, matched))
+    return recovered
+
+
+def benchmark(
+    k_radius=1,
+    steps=DEFAULT_TEST_STEPS,
+    seed_file=DEFAULT_TEST_SEED,
+    num_rules=None,
+    workers=None,
+    random_seed=None,
+):
+    """
+    Generate, learn and score rules of a kernel radius in-process on a worker pool
+    """
+    from midi import get_seed_from_file
+
+    seed = get_seed_from_file(seed_file)
+    activation_size = 2 ** ((k_radius * 2) + 1)
+    rule_space_size = 2 ** activation_size
+
+    if num_rules is None or num_rules >= rule_space_size:
+        if rule_space_size > MAX_EXHAUSTIVE_RULES:
+            print(
+                "Rule space of {} rules is too large, use --numRules".format(
+                    rule_space_size
+                )
+            )
+            exit(1)
+        rule_numbers = list(range(rule_space_size))
+    else:
+        rng = random.Random(random_seed)
+        rule_numbers = sorted(
+            set(rng.getrandbits(activation_size) for _ in range(num_rules))
+        )
+
+    workers = workers or os.cpu_count()
+    chunks = [
+        (k_radius, chunk, seed, steps)
+        for chunk in np.array_split(rule_numbers, workers * 4)
+        if len(chunk)
+    ]
+
+    start = time.time()
+    with Pool(workers) as pool:
+        recovered = [r for chunk in pool.map(recover_rules, chunks) for r in chunk]
+    wall_time = time.time() - start
+
+    total = len(recovered)
+    matched = sum(1 for _, _, _, m in recovered if m)
+    ambiguous_patterns = sum(1 for _, _, a, _ in recovered if a)
+
+    return {
+        "score": matched / total,
+        "ambiguous_pattern_rate": ambiguous_patterns / total,
+        "num_rules": total,
+        "wall_time": wall_time,
+        "rules_per_second": total / wall_time,
+        "cells_per_second": total * steps * len(seed) / wall_time,
     }
 
-write_results(results)
 
-# generate score
-total = len(results.keys())
-matched = 0
-ambiguous_patterns = 0
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Score how well learned rules recover the rules that generated them."
+    )
+
+    parser.add_argument(
+        "--testDir",
+        action="store_true",
+        default=False,
+        help="Score rule and states files written to {} by the CLI instead.".format(
+            TEST_DIR
+        ),
+    )
+
+    parser.add_argument(
+        "--kernelRadius",
+        metavar="R",
+        type=int,
+        default=1,
+        help="The radius of the kernel of the rules to recover.",
+    )
+
+    parser.add_argument(
+        "--steps",
+        metavar="L",
+        type=int,
+        default=DEFAULT_TEST_STEPS,
+        help="The number of steps generated from each rule. (Default: {})".format(
+            DEFAULT_TEST_STEPS
+        ),
+    )
+
+    parser.add_argument(
+        "--seed",
+        metavar="S",
+        type=str,
+        default=DEFAULT_TEST_SEED,
+        help="Seed file used to generate states. (Default: {})".format(
+            DEFAULT_TEST_SEED
+        ),
+    )
+
+    parser.add_argument(
+        "--numRules",
+        metavar="N",
+        type=int,
+        default=None,
+        help="Score a random sample of N rules instead of the whole rule space.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        metavar="W",
+        type=int,
+        default=None,
+        help="Number of worker processes. (Default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--randomSeed",
+        metavar="RS",
+        type=int,
+        default=None,
+        help="Seed for sampling rules with --numRules.",
+    )
+
+    args = parser.parse_args()
+
+    if args.testDir:
+        score, ambiguous_pattern_rate = score_test_dir()
+        print("ambiguous_pattern_rate: {}".format(ambiguous_pattern_rate))
+        print("score: {}".format(score))
+        return
 
-# count matches
-for k in results:
-    result = results[k]
-    if check_result(result, states_by_rule_int):
-        matched += 1
+    report = benchmark(
+        k_radius=args.kernelRadius,
+        steps=args.steps,
+        seed_file=args.seed,
+        num_rules=args.numRules,
+        workers=args.workers,
+        random_seed=args.randomSeed,
+    )
+    for key in report:
+        print("{}: {}".format(key, report[key]))
 
-# count ambiguous patterns:
-for k in results:
-    result = results[k]
-    if not check_result(result, states_by_rule_int, check_ambiguous=False):
-        ambiguous_patterns += 1
 
-print("ambiguous_pattern_rate: {}".format(ambiguous_patterns / total))
-print("score: {}".format(matched / total))
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from functools import partial
+from multiprocessing import Pool, current_process
+
+import numpy as np
+
+import sampling
+from ca import DEFAULT_SEED, DEFAULT_SEQUENCE_STEPS, rule_cell_states
+from midi import (
+    DEFAULT_BEAT_DURATION,
+    get_rule_from_file,
+    get_scale,
+    get_seed_from_file,
+    simulate_states,
+)
+from midiwriter import DEFAULT_TEMPO, MidiFileWriter, write_states_track
+
+
+def load_tracks(f_name):
+    """
+    Read the tracks of a tracks file
+
+    A tracks file is a JSON object with a "tracks" list, or just the list.  Each track
+    has a "rule" path, and optionally a "seed" path, "scale_num", "scale_type",
+    "sampler", "voices", "random_seed", "dont_ignore_odd", "detect_cycles", and the
+    "name", "program" and "is_drum" of its MIDI track.
+    """
+    with open(f_name, "r") as tracks_file:
+        tracks = json.load(tracks_file)
+    if isinstance(tracks, dict):
+        tracks = tracks["tracks"]
+
+    tracks = [dict(track) for track in tracks]
+    for i, track in enumerate(tracks):
+        if "rule" not in track:
+            raise ValueError("Track {} in {} has no rule".format(i, f_name))
+        track.setdefault("name", "track_{}".format(i))
+    return tracks
+
+
+def simulate_track(track, steps=DEFAULT_SEQUENCE_STEPS):
+    """
+    Simulate the states of one track, returning them with its cell states and scale
+    """
+    start = time.time()
+    rule = get_rule_from_file(track["rule"])
+    if track.get("seed"):
+        seed = get_seed_from_file(track["seed"])
+        width = len(seed)
+    else:
+        seed = DEFAULT_SEED
+        width = 128
+
+    states = simulate_states(
+        rule,
+        seed,
+        steps,
+        dont_ignore_odd=track.get("dont_ignore_odd", False),
+        detect_cycles=track.get("detect_cycles", False),
+        sampler_name=track.get("sampler"),
+        voices=track.get("voices", sampling.DEFAULT_VOICES),
+        random_seed=track.get("random_seed"),
+    )
+    scale = get_scale(track.get("scale_num"), track.get("scale_type", "maj"))
+    return {
+        "states": np.asarray(states, dtype=np.uint8),
+        "cell_states": rule_cell_states(rule),
+        "scale": np.asarray(scale[0:width]),
+        "seconds": time.time() - start,
+    }
+
+
+def generate_tracks(
+    f_name,
+    steps=DEFAULT_SEQUENCE_STEPS,
+    beat_duration=DEFAULT_BEAT_DURATION,
+    workers=None,
+    tempo=DEFAULT_TEMPO,
+):
+    """
+    Simulate every track of a tracks file on a process pool and write them as one
+    multi-track MIDI file
+
+    Tracks are written in order as soon as they and the tracks before them are
+    simulated, so the file is done shortly after the slowest track.  Returns the
+    seconds each track took to simulate.
+    """
+    tracks = load_tracks(f_name)
+    mid_file = "{f_name}.tendril.{ext}".format(f_name=f_name, ext="mid")
+    workers = min(workers or os.cpu_count(), len(tracks))
+    if current_process().daemon:
+        # e.g. a --batch job, whose pool workers can't start a pool of their own
+        workers = 1
+
+    seconds = []
+    with MidiFileWriter(mid_file, num_tracks=len(tracks), tempo=tempo) as writer:
+
+        def write_track(track, result):
+            write_states_track(
+                writer,
+                result["states"],
+                result["scale"],
+                steps,
+                beat_duration,
+                name=track["name"],
+                program=track.get("program", 0),
+                cell_states=result["cell_states"],
+                is_drum=track.get("is_drum", False),
+            )
+            seconds.append(result["seconds"])
+
+        if workers == 1:
+            for track in tracks:
+                write_track(track, simulate_track(track, steps))
+        else:
+            with Pool(workers) as pool:
+                results = pool.imap(partial(simulate_track, steps=steps), tracks)
+                for track, result in zip(tracks, results):
+                    write_track(track, result)
+
+    for track, s in zip(tracks, seconds):
+        print("{}: {:.3f}s".format(track["name"], s))
+    print("writing midi file to: ", mid_file)
+    return seconds